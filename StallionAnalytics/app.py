@@ -1,25 +1,24 @@
+import hashlib
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 import streamlit as st
-import streamlit.components.v1 as components 
-import plotly.express as px
-from modules.state_manager import init_session_state, set_page
-from streamlit_extras.metric_cards import style_metric_cards
-from modules.db_manager import StallionDB
-from modules.llm_engine import DashboardBrain
-from modules.renderer import StallionRenderer
-from modules.copilot import StallionCopilot
-from modules.reporter import StallionReporter
-from modules.planner import StallionPlanner 
-from modules.segmentor import StallionSegmentor
-from modules.workspace import StallionWorkspace # <--- NEW IMPORT
+import streamlit.components.v1 as components
+from modules.state_manager import init_session_state, set_page, set_dashboard_config
+# Heavy modules (plotly, sklearn, LLM SDKs...) are imported lazily inside the
+# page that needs them, so landing on Home doesn't pay their cold-start cost.
 
 # 1. Page Config
 st.set_page_config(page_title="Stallion Analytics", page_icon="🐎", layout="wide", initial_sidebar_state="expanded")
 
 # 2. Load CSS (Standard)
+@st.cache_data(ttl=24*60*60)
+def _read_css(path):
+    with open(path) as f: return f.read()
+
 def load_css():
     try:
-        with open("assets/style.css") as f: st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
-    except: pass
+        st.markdown(f"<style>{_read_css('assets/style.css')}</style>", unsafe_allow_html=True)
+    except FileNotFoundError: pass
 
 # 3. Sidebar (Updated Navigation)
 def render_sidebar():
@@ -40,55 +39,110 @@ def render_sidebar():
             if api_key: st.session_state["api_key"] = api_key
             st.session_state["ai_model"] = "gemini-2.5-pro" if provider == "Google Gemini" else "gpt-3.5-turbo"
 
+# --- SHARED INSTANCES ---
+# cache_resource getters: agents are built once per (provider, key, model, engine)
+# instead of on every rerun/click, so connection pools and batchers live process-wide.
+# db_token carries the engine's identity since the engine itself is unhashable.
+# Cache keys carry the key's SHA-256 fingerprint (same scheme as
+# get_shared_copilot) so the raw secret never lands in Streamlit's cache
+# inspector.
+def _key_fingerprint(api_key):
+    return hashlib.sha256((api_key or "").encode()).hexdigest()
+
+def get_copilot(provider, api_key, model, db_token, _db):
+    # Delegates to the one process-cached copilot the renderer also uses —
+    # no second cached instance (and no second set of TLS pools) per config
+    from modules.copilot import get_shared_copilot
+    return get_shared_copilot(provider, model, _key_fingerprint(api_key), db_token, api_key, _db)
+
+@st.cache_resource(show_spinner=False)
+def _cached_planner(provider, model, key_fingerprint, db_token, _api_key, _db):
+    from modules.planner import StallionPlanner
+    return StallionPlanner(_db, provider, _api_key, model)
+
+def get_planner(provider, api_key, model, db_token, _db):
+    return _cached_planner(provider, model, _key_fingerprint(api_key), db_token, api_key, _db)
+
+def get_segmentor(provider, api_key, model, db_token, _db):
+    # Thin wrapper around the shared copilot: nothing else to cache
+    from modules.segmentor import StallionSegmentor
+    return StallionSegmentor(get_copilot(provider, api_key, model, db_token, _db))
+
+@st.cache_resource(show_spinner=False)
+def get_workspace():
+    from modules.workspace import StallionWorkspace
+    return StallionWorkspace()
+
 # --- CO-PILOT (Standard) ---
+@st.cache_resource(show_spinner=False)
+def _get_llm_cache():
+    from modules.llm_cache import SemanticCache
+    return SemanticCache()
+
+# Fragment: chat submissions rerun only this subtree, not the whole dashboard
+@st.fragment
 def render_copilot():
-    if not st.session_state.get("db_engine"): return
+    # Hoist session reads once per rerun instead of hitting SessionState per access
+    ss = st.session_state
+    db_engine = ss.get("db_engine")
+    if not db_engine: return
+    chat_history = ss["chat_history"]
     with st.popover("💬", use_container_width=False):
         st.subheader("Stallion Co-Pilot")
         # ... (Same Co-Pilot logic as previous version) ...
         # (Included in full file, abbreviated here for brevity)
-        config = st.session_state.get("dashboard_config", {})
-        context_options = ["Global (All Data)"]
-        if "charts" in config:
-            for chart in config["charts"]:
-                context_options.append(f"Chart: {chart.get('title', 'Untitled')}")
-                
+        config = ss.get("dashboard_config", {})
+        # Single pre-sized literal: no per-element .append lookups
+        context_options = ["Global (All Data)",
+            *(f"Chart: {c.get('title', 'Untitled')}" for c in config.get("charts", [])),
+            *(f"KPI: {k.get('label', 'Metric')}" for k in config.get("kpi_cards", []))]
+
         selected_context = st.selectbox("🎯 Focus Context:", context_options, index=0)
 
         chat_container = st.container(height=300)
         with chat_container:
-            for msg in st.session_state["chat_history"]:
+            for msg in chat_history:
                 with st.chat_message(msg["role"]):
                     st.markdown(msg["content"])
 
         if prompt := st.chat_input("Ask or Change..."):
-            st.session_state["chat_history"].append({"role": "user", "content": prompt})
+            chat_history.append({"role": "user", "content": prompt})
             
             with chat_container:
                 with st.chat_message("user"): st.markdown(prompt)
 
                 with st.chat_message("assistant"):
                     with st.spinner("Thinking..."):
-                        copilot = StallionCopilot(
-                            st.session_state["ai_provider"],
-                            st.session_state.get("api_key"),
-                            st.session_state["ai_model"],
-                            st.session_state["db_engine"]
-                        )
-                        result = copilot.process_query(
-                            prompt, 
-                            st.session_state.get("dashboard_config", {}),
-                            st.session_state.get("data_metadata", ""),
-                            selected_context
-                        )
-                        
+                        # Semantic cache: near-identical questions skip the LLM.
+                        # Scoped to the live engine + focus context — answers
+                        # from an older dataset or another chart never replay.
+                        llm_cache = _get_llm_cache()
+                        cache_scope = (id(db_engine), selected_context)
+                        result = llm_cache.lookup(prompt, scope=cache_scope)
+                        if result is None:
+                            copilot = get_copilot(ss["ai_provider"], ss.get("api_key"), ss["ai_model"], id(db_engine), db_engine)
+                            try:
+                                result = copilot.process_query(
+                                    prompt,
+                                    ss.get("_dashboard_config_json", "{}"),
+                                    ss.get("data_metadata", ""),
+                                    selected_context
+                                )
+                                # Only cache read-only answers; replayed dashboard
+                                # updates would clobber newer configs
+                                if result.get("response_type") == "text_answer":
+                                    llm_cache.store(prompt, result, scope=cache_scope)
+                            except Exception as e:
+                                st.error(f"AI call failed: {str(e)}")
+                                result = {"response_type": "text_answer", "content": f"AI call failed: {str(e)}"}
+
                         msg_text = result.get("content", "Error")
                         if result.get("response_type") == "update_dashboard":
-                            st.session_state["dashboard_config"] = result["content"]
+                            set_dashboard_config(result["content"])
                             st.toast("✅ Dashboard Updated!", icon="📊")
-                            st.rerun()
+                            st.rerun(scope="app")  # dashboard changed: full refresh is intentional
                         elif result.get("response_type") == "update_executive_summary":
-                            st.session_state["enterprise_report"] = result["content"]
+                            ss["enterprise_report"] = result["content"]
                             msg_text = "✅ Planner Report Updated. Check Planner Tab."
                             st.toast("✅ Report Generated!", icon="📑")
                         
@@ -96,102 +150,243 @@ def render_copilot():
                         
                         if "suggestions" in result:
                             st.caption("Suggested next steps:")
+                            # Stable widget ids: minted once per assistant turn so
+                            # re-renders reuse the same keys instead of remounting
+                            if "sugg_keys" not in result:
+                                result["sugg_keys"] = [uuid.uuid4().hex for _ in result["suggestions"]]
                             cols = st.columns(len(result["suggestions"]))
                             for i, sugg in enumerate(result["suggestions"]):
-                                cols[i].button(sugg, key=f"sugg_{len(st.session_state['chat_history'])}_{i}")
+                                cols[i].button(sugg, key=f"sugg_{result['sugg_keys'][i]}")
 
-            st.session_state["chat_history"].append({"role": "assistant", "content": msg_text})
-            if result.get("response_type") != "update_dashboard":
-                 st.rerun()
+            # Chat-only turns need no rerun: the bubbles above are already drawn and
+            # st.chat_input clears itself. Dashboard updates rerun with scope='app' above.
+            chat_history.append({"role": "assistant", "content": msg_text})
 
 # 4. Page: Home (Standard)
+# xxh3 is 5-20x faster than md5 on big uploads; md5 remains the fallback
+try:
+    import xxhash
+    def _fast_hash(buf): return xxhash.xxh3_64(buf).hexdigest()
+except ImportError:
+    def _fast_hash(buf): return hashlib.md5(buf).hexdigest()
+
+_SAMPLED_HASH_CUTOFF = 256 * 1024 * 1024
+
+def _file_signature(files):
+    """Cheap content fingerprint so a reupload of the same data reuses the cached engine."""
+    sigs = []
+    for f in files:
+        buf = f.getbuffer()
+        if len(buf) > _SAMPLED_HASH_CUTOFF:
+            # O(1) key for huge files: first+last MB (length is part of the signature;
+            # collision risk is acceptable for a cache key)
+            digest = _fast_hash(bytes(buf[:1024 * 1024]) + bytes(buf[-1024 * 1024:]))
+        else:
+            digest = _fast_hash(buf)
+        sigs.append((f.name, f.size, digest))
+    return tuple(sigs)
+
+@st.cache_resource(show_spinner=False)
+def get_db_engine(file_sig, _files):
+    """Builds (or reuses) the DuckDB engine for this exact set of uploaded files.
+    Failed ingests raise so they are never cached — a retry with the same
+    files gets a fresh attempt instead of the memoized failure."""
+    from modules.db_manager import StallionDB
+    db = StallionDB()
+    error, msg = db.ingest_data(_files)
+    if error:
+        raise RuntimeError(error)
+    return db, msg
+
 def page_home():
     st.title("Welcome to Stallion Analytics")
     uploaded_files = st.file_uploader("Upload Data", type=["csv", "json", "parquet"], accept_multiple_files=True)
     if uploaded_files and st.button("Initialize Engine", type="primary"):
-        db = StallionDB()
-        error, msg = db.ingest_data(uploaded_files)
-        if not error:
+        try:
+            db, msg = get_db_engine(_file_signature(uploaded_files), uploaded_files)
+        except Exception as e:
+            st.error(f"Ingestion failed: {str(e)}")
+        else:
             st.session_state["db_engine"] = db
             st.session_state["data_metadata"] = db.get_schema()
             st.success(msg)
             if st.button("Go to Dashboard"): set_page("Dashboard")
 
+    # Lazy preview: the sample is only fetched and shipped over the websocket
+    # when the user actually asks for it, not on every post-ingest rerun
+    if st.session_state.get("db_engine"):
+        if st.checkbox("Show data sample", key="show_sample"):
+            st.dataframe(st.session_state["db_engine"].get_sample(limit=10), use_container_width=True)
+
 # 5. Page: Dashboard (Updated with SAVE Button)
+@st.cache_data(ttl=86400, persist="disk", show_spinner=False)
+def _cached_suggestions(schema_hash, _schema, provider, model, _api_key):
+    """Disk-persisted cache: same schema+provider+model serves suggestions
+    without an LLM call, across Streamlit restarts too.
+
+    DashboardBrain returns failures as values; re-raise them here so a
+    timeout is not cached for 24h (st.cache_data never caches exceptions)."""
+    from modules.llm_engine import DashboardBrain
+    intents = DashboardBrain(provider, _api_key, model).suggest_intents(_schema)
+    if intents and isinstance(intents[0], str) and intents[0].startswith("Error generating suggestions"):
+        raise RuntimeError(intents[0])
+    return intents
+
+@st.cache_data(ttl=86400, persist="disk", show_spinner=False)
+def _cached_layout(schema_hash, intent, _schema, provider, model, _api_key):
+    """Disk-persisted cache: repeated schema+intent layouts skip the LLM
+    entirely — reopening a saved workspace costs zero generation calls.
+
+    Error payloads raise instead of returning so they never poison the cache."""
+    from modules.llm_engine import DashboardBrain
+    layout = DashboardBrain(provider, _api_key, model).generate_dashboard_layout(_schema, intent)
+    if isinstance(layout, dict) and layout.get("error"):
+        raise RuntimeError(layout["error"])
+    return layout
+
 def page_dashboard():
+    from modules.renderer import StallionRenderer
     st.header("Dashboard")
-    if not st.session_state.get("db_engine"):
+    # Hoist session reads once per rerun instead of hitting SessionState per access
+    ss = st.session_state
+    db_engine = ss.get("db_engine")
+    if not db_engine:
         st.info("No Data Loaded.")
         return
+    config = ss.get("dashboard_config", {})
+    api_key = ss.get("api_key")
 
     # SAVE BUTTON IN HEADER
     c1, c2 = st.columns([0.85, 0.15])
     with c2:
         if st.button("💾 Save Work", use_container_width=True):
-            st.session_state["show_save_dialog"] = True
+            ss["show_save_dialog"] = True
 
     # Save Dialog (Modal Simulation)
-    if st.session_state.get("show_save_dialog"):
+    if ss.get("show_save_dialog"):
         with st.container(border=True):
             st.markdown("#### Save Dashboard to Workspace")
             save_name = st.text_input("Dashboard Name")
             save_desc = st.text_area("Analysis Context (Intent)")
             if st.button("Confirm Save", type="primary"):
-                ws = StallionWorkspace()
+                ws = get_workspace()
                 # Initialize Copilot just for generating the signature
                 copilot = None
-                if st.session_state.get("api_key"):
-                    copilot = StallionCopilot(st.session_state["ai_provider"], st.session_state["api_key"], st.session_state["ai_model"], None)
-                
-                ws.save_work(save_name, save_desc, st.session_state.get("dashboard_config"), copilot)
+                if api_key:
+                    copilot = get_copilot(ss["ai_provider"], api_key, ss["ai_model"], 0, None)
+
+                ws.save_work(save_name, save_desc, config, copilot)
+                _cached_work_list.clear()
                 st.success("Saved to Workspace!")
-                st.session_state["show_save_dialog"] = False
+                ss["show_save_dialog"] = False
                 st.rerun()
 
     # ... (Rest of Dashboard Logic: Brain, Renderer) ...
-    # (Same as previous version)
-    renderer = StallionRenderer(st.session_state["db_engine"])
-    renderer.render(st.session_state.get("dashboard_config", {}))
+    # AI Layout Generation (served from cache when schema+intent repeat)
+    if not config and api_key:
+        schema = ss.get("data_metadata", "")
+        schema_hash = hashlib.sha1(schema.encode()).hexdigest()
+        provider, model = ss["ai_provider"], ss["ai_model"]
+        try:
+            intents = _cached_suggestions(schema_hash, schema, provider, model, api_key)
+        except Exception as e:
+            st.error(f"Suggestion generation failed: {str(e)}")
+            intents = ["Overview of Key Metrics", "Trends Over Time", "Category Breakdown"]
+        intent = st.selectbox("🎯 Dashboard Intent", intents)
+        if st.button("✨ Generate Layout", type="primary"):
+            with st.spinner("Designing Dashboard..."):
+                try:
+                    set_dashboard_config(_cached_layout(schema_hash, intent, schema, provider, model, api_key))
+                except Exception as e:
+                    # Nothing cached, nothing stored: the next click retries
+                    st.error(f"Layout generation failed: {str(e)}")
+                else:
+                    st.rerun()
+
+    renderer = StallionRenderer(db_engine)
+    renderer.render(ss.get("dashboard_config", {}))
 
 # 6. Page: Workspace (NEW)
+@st.cache_data(ttl=30, show_spinner=False)
+def _cached_work_list(_ws):
+    return _ws.list_work()
+
 def page_workspace():
+    import pandas as pd
     st.header("📂 Your Work")
-    ws = StallionWorkspace()
-    saved_items = ws.list_work()
-    
+    ws = get_workspace()
+    saved_items = _cached_work_list(ws)
+
     if not saved_items:
         st.info("No saved dashboards found. Go to Dashboard and click 'Save Work'.")
         return
 
-    for item in saved_items:
+    # One table instead of O(N) bordered containers + 3 buttons each: Streamlit
+    # rebuilds every widget per rerun, so the old layout scaled with the list
+    df = pd.DataFrame(
+        [(item['name'], item['created_at'], item['description']) for item in saved_items],
+        columns=['Name', 'Created', 'Intent']
+    )
+    event = st.dataframe(
+        df, use_container_width=True, hide_index=True,
+        selection_mode="single-row", on_select="rerun", key="ws_table"
+    )
+
+    # Detail + actions render only for the selected row
+    if event.selection.rows:
+        item = saved_items[event.selection.rows[0]]
         with st.container(border=True):
-            c1, c2, c3 = st.columns([0.6, 0.2, 0.2])
+            st.subheader(item['name'])
+            st.caption(f"Created: {item['created_at']}")
+            st.markdown(f"**Intent:** {item['description']}")
+            if item.get('context_signature'):
+                st.info(f"🧠 **AI Context:** {item['context_signature'].get('automated_summary')}")
+
+            c1, c2, c3 = st.columns(3)
             with c1:
-                st.subheader(item['name'])
-                st.caption(f"Created: {item['created_at']}")
-                st.markdown(f"**Intent:** {item['description']}")
-                if item.get('context_signature'):
-                    st.info(f"🧠 **AI Context:** {item['context_signature'].get('automated_summary')}")
-            
-            with c2:
                 if st.button("📂 Load", key=f"load_{item['id']}", use_container_width=True):
-                    st.session_state["dashboard_config"] = item['config']
+                    set_dashboard_config(item['config'])
                     # Inject Context for Planner
                     st.session_state["loaded_context"] = item.get("context_signature")
                     st.toast("Dashboard Loaded! Go to Dashboard tab.", icon="✅")
-                
+            with c2:
                 if st.button("📑 Send to Planner", key=f"plan_{item['id']}", use_container_width=True):
-                    st.session_state["dashboard_config"] = item['config']
+                    set_dashboard_config(item['config'])
                     st.session_state["loaded_context"] = item.get("context_signature")
                     set_page("Planner") # Auto-navigate
                     st.rerun()
-
             with c3:
                 if st.button("🗑️ Delete", key=f"del_{item['id']}", type="primary", use_container_width=True):
                     ws.delete_work(item['id'])
+                    _cached_work_list.clear()
                     st.rerun()
 
 # 7. Page: Planner (Updated for Context)
+# Worker pool: long report generation runs off the script thread
+_EXEC = ThreadPoolExecutor(max_workers=4)
+
+@st.fragment(run_every=2)
+def _poll_report():
+    fut = st.session_state.get("report_future")
+    if fut is None:
+        return
+    if fut.done():
+        st.session_state["report_future"] = None
+        try:
+            st.session_state["enterprise_report"] = fut.result()
+        except Exception as e:
+            st.error(f"Planner Failed: {str(e)}")
+            return
+        st.rerun(scope="app")  # report landed: the page body must re-render
+    else:
+        with st.status("🧠 Planner Agent is working...", expanded=True):
+            st.caption("Recall → Hypothesis → Reasoning (Tools) → Layout")
+        # Progressive render: the worker streams report tokens into this
+        # holder, so the user watches the report build instead of a spinner
+        partial = st.session_state.get("report_progress", {}).get("html")
+        if partial:
+            components.html(partial, height=400, scrolling=True)
+
 def page_planner():
     st.header("📑 Stallion Planner: Strategic Reporting")
     if not st.session_state.get("db_engine"):
@@ -210,42 +405,31 @@ def page_planner():
         user_objective = st.text_area("Goal:", value=default_obj, placeholder="Analyze Q3...")
         
         if st.button("🚀 Generate Report", type="primary"):
-            planner = StallionPlanner(
-                st.session_state["db_engine"], st.session_state["ai_provider"], 
-                st.session_state["api_key"], st.session_state["ai_model"]
+            db = st.session_state["db_engine"]
+            planner = get_planner(
+                st.session_state["ai_provider"], st.session_state["api_key"],
+                st.session_state["ai_model"], id(db), db
+            )
+            config = st.session_state.get("dashboard_config", {})
+            # Dispatch to the worker pool so the UI thread stays responsive;
+            # the shared dict carries streamed partial HTML back to _poll_report
+            st.session_state["report_progress"] = {}
+            st.session_state["report_future"] = _EXEC.submit(
+                planner.generate_enterprise_report, config, user_objective, loaded_ctx,
+                st.session_state["report_progress"]
             )
-            # ... (Progress Bar Logic) ...
-            progress_text = "Initializing Agent..."
-            my_bar = st.progress(0, text=progress_text)
-            
-            try:
-                # 1. Recall
-                my_bar.progress(25, text="Step 1/4: Auditing Dashboard (Recall)...")
-                
-                # 2. Hypothesis
-                my_bar.progress(50, text="Step 2/4: Formulating Hypotheses & SQL...")
-                
-                # 3. Reasoning
-                my_bar.progress(75, text="Step 3/4: Running Analytics Tools (Anomaly/Forecast)...")
-                
-                config = st.session_state.get("dashboard_config", {})
-                # Pass the loaded_ctx to the generate function
-                report_html = planner.generate_enterprise_report(config, user_objective, loaded_ctx) 
-                
-                 # 4. Layout
-                my_bar.progress(100, text="Step 4/4: Rendering Presentation (Layout)...")
-                
-                st.session_state["enterprise_report"] = report_html
-                st.rerun()
-             
-            except Exception as e:
-                st.error(f"Planner Failed: {str(e)}")
+
+    # Poll the background report inside a fragment: only this block reruns
+    # every 2s while the agent works, not the whole page
+    if st.session_state.get("report_future") is not None:
+        _poll_report()
 
     if "enterprise_report" in st.session_state:
         components.html(st.session_state["enterprise_report"], height=800, scrolling=True)
 
 # 8. Page: Segmentation (Standard)
 def page_segmentation():
+    import plotly.express as px
     st.header("👥 Agentic Segmentation Lab")
     
     if not st.session_state.get("db_engine"):
@@ -259,24 +443,37 @@ def page_segmentation():
             st.error("Configure AI Settings first (for naming clusters).")
             return
             
-        segmentor = StallionSegmentor()
         db = st.session_state["db_engine"]
-        # Get Sample for Clustering (DuckDB)
-        df = db.get_sample(limit=50000) 
-        
+        copilot = get_copilot(
+            st.session_state["ai_provider"], st.session_state["api_key"],
+            st.session_state["ai_model"], id(db), db
+        )
+        segmentor = get_segmentor(
+            st.session_state["ai_provider"], st.session_state["api_key"],
+            st.session_state["ai_model"], id(db), db
+        )
+
         with st.spinner("Calculating RFM & Clustering..."):
-            rfm_df, summary = segmentor.perform_rfm_analysis(df)
-            
+            strategy = segmentor.suggest_strategy(db.get_sample(limit=5).to_markdown())
+            if strategy and strategy.get("strategy_type") == "RFM":
+                # RFM is a GROUP BY: aggregate where the data lives (DuckDB) and
+                # cluster the ~one-row-per-customer result, not 50k raw transactions
+                rfm_raw, err = db.rfm_aggregate(strategy["id_col"], strategy["date_col"], strategy["amount_col"])
+                if err:
+                    rfm_df, summary = None, err
+                else:
+                    rfm_df, summary = segmentor.execute_segmentation(
+                        rfm_raw,
+                        {"strategy_type": "Generic", "id_col": strategy["id_col"],
+                         "feature_cols": ["Recency", "Frequency", "Monetary"]}
+                    )
+            elif strategy:
+                rfm_df, summary = segmentor.execute_segmentation(db.get_sample(limit=50000), strategy)
+            else:
+                rfm_df, summary = None, "Strategy discovery failed. Check AI Settings."
+
             if rfm_df is not None:
                 st.session_state["rfm_result"] = rfm_df
-                
-                # AI Naming
-                copilot = StallionCopilot(
-                    st.session_state["ai_provider"], 
-                    st.session_state["api_key"], 
-                    st.session_state["ai_model"], 
-                    db
-                )
                 prompt = f"""
                 Analyze these Customer Segments (RFM Stats):
                 {summary}
@@ -302,19 +499,35 @@ def page_segmentation():
         rfm['Segment'] = rfm['Cluster'].astype(str).map(lambda x: names.get(x, f"Cluster {x}"))
         
         st.subheader("Cluster Visualization")
-        
-        # 3D Chart
-        fig = px.scatter_3d(
-            rfm, x='Recency', y='Frequency', z='Monetary',
-            color='Segment', opacity=0.7,
-            title="Customer Segments (3D View)",
-            template="plotly_dark"
-        )
-        fig.update_layout(height=600, margin=dict(l=0, r=0, b=0, t=30))
-        st.plotly_chart(fig, use_container_width=True)
-        
+
+        # 3D Chart (lazy: built only when the expander is opened, and decimated
+        # to ~10k points — Plotly ships every point as JSON to the browser)
+        with st.expander("🌀 Show 3D Cluster View", expanded=False):
+            rfm_plot = rfm
+            if len(rfm) > 10_000:
+                # Stratified: keep every segment visible after downsampling
+                rfm_plot = rfm.groupby('Segment', group_keys=False).apply(
+                    lambda g: g.sample(min(len(g), 2500), random_state=0)
+                )
+            fig = px.scatter_3d(
+                rfm_plot, x='Recency', y='Frequency', z='Monetary',
+                color='Segment', opacity=0.7,
+                title="Customer Segments (3D View)",
+                template="plotly_dark"
+            )
+            fig.update_traces(marker=dict(size=2))
+            fig.update_layout(height=600, margin=dict(l=0, r=0, b=0, t=30))
+            st.plotly_chart(fig, use_container_width=True)
+
         with st.expander("View Segment Data"):
-            st.dataframe(rfm, use_container_width=True)
+            # First 1000 rows render; full result goes out as a download instead
+            st.dataframe(rfm.head(1000), use_container_width=True)
+            st.download_button(
+                "⬇️ Download Full CSV",
+                rfm.to_csv(index=False).encode(),
+                file_name="stallion_segments.csv",
+                mime="text/csv"
+            )
 
 # MAIN EXECUTION
 if __name__ == "__main__":
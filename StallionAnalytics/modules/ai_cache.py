@@ -0,0 +1,76 @@
+import os
+import sqlite3
+import threading
+import time
+
+# Default lifetime for persisted responses; st.cache_data already handles the
+# hot in-process hits, this layer exists to survive Streamlit restarts
+AI_CACHE_TTL = 7 * 24 * 3600
+_DB_PATH = os.path.join(".cache", "ai_responses.db")
+
+
+class PersistentAICache:
+    """
+    Disk-backed (prompt hash -> response) store for deterministic LLM calls.
+
+    Sits underneath the in-memory st.cache_data layer: identical prompts are
+    free within a session already, this makes them free across restarts and
+    across users sharing the process. Every operation is wrapped defensively —
+    a broken cache file must never break an AI call.
+    """
+
+    def __init__(self, path=_DB_PATH, ttl=AI_CACHE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Copilot calls arrive from worker threads (batcher, planner pool)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses (hash TEXT PRIMARY KEY, response TEXT, created_at REAL)"
+            )
+            self._conn.commit()
+        except Exception:
+            self._conn = None
+
+    def lookup(self, prompt_hash):
+        """Returns the cached response, or None on miss/expiry/error."""
+        if self._conn is None:
+            return None
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT response, created_at FROM responses WHERE hash = ?", (prompt_hash,)
+                ).fetchone()
+            if row and (time.time() - row[1]) < self.ttl:
+                return row[0]
+        except Exception:
+            pass
+        return None
+
+    def store(self, prompt_hash, response):
+        if self._conn is None or not isinstance(response, str):
+            return
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO responses (hash, response, created_at) VALUES (?, ?, ?)",
+                    (prompt_hash, response, time.time()),
+                )
+                self._conn.commit()
+        except Exception:
+            pass
+
+
+_instance = None
+_instance_lock = threading.Lock()
+
+
+def get_ai_cache():
+    """Process-wide singleton: one sqlite handle shared by all agents."""
+    global _instance
+    if _instance is None:
+        with _instance_lock:
+            if _instance is None:
+                _instance = PersistentAICache()
+    return _instance
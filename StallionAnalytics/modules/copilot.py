@@ -1,8 +1,119 @@
-import google.generativeai as genai
-import openai
+import asyncio
+import hashlib
 import json
+import os
+import random
+import re
 import streamlit as st
-import pandas as pd
+from functools import lru_cache
+from string import Template
+
+from modules.ai_cache import get_ai_cache
+from modules.llm_batcher import get_batcher
+
+__all__ = ["StallionCopilot", "get_shared_copilot"]
+
+# Network guardrails: a slow endpoint must not freeze the Streamlit rerun forever,
+# and responses must not blow past context limits into partial parses.
+LLM_TIMEOUT = 20
+LLM_MAX_RETRIES = 3
+LLM_MAX_OUTPUT_TOKENS = 1024
+# Full HTML reports and dashboard-config JSON run to multiple KB; the default
+# cap silently truncates them mid-document, so long-form calls get their own budget.
+LLM_MAX_REPORT_TOKENS = 8192
+LLM_MAX_CONCURRENCY = int(os.getenv("STALLION_MAX_CONCURRENCY", "8"))
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _call_ai_cached(provider, model, prompt_hash, _invoke):
+    """Replays identical prompt+model responses from cache: Streamlit reruns and
+    repeated 'Analyze' clicks stop paying network + LLM latency twice."""
+    return _invoke()
+
+# One compiled pattern strips the markdown fences in a single scan instead of
+# two full .replace passes over a reply that can be tens of KB of HTML
+_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$", re.M)
+
+_PRIORITY_COL_RE = re.compile(r"id|date|time|key|amount|price|total|qty|count|revenue|sales", re.I)
+
+def _compact_schema(schema, max_cols=80):
+    """Caps the column lines sent to the LLM: prompt tokens (and prefill
+    latency) grow linearly with schema width, and a 500-column warehouse
+    dump mostly drowns the useful joins. IDs/dates/measures are kept first,
+    the remainder is stride-sampled."""
+    lines = schema.splitlines()
+    col_idx = [i for i, l in enumerate(lines) if l.lstrip().startswith("- ")]
+    if len(col_idx) <= max_cols:
+        return schema
+    priority = [i for i in col_idx if _PRIORITY_COL_RE.search(lines[i])][:max_cols]
+    rest = [i for i in col_idx if i not in set(priority)]
+    budget = max_cols - len(priority)
+    keep = set(priority)
+    if budget > 0 and rest:
+        stride = max(1, len(rest) // budget)
+        keep.update(rest[::stride][:budget])
+    drop = set(col_idx) - keep
+    out = [l for i, l in enumerate(lines) if i not in drop]
+    out.append(f"... ({len(drop)} more columns omitted)")
+    return "\n".join(out)
+
+@lru_cache(maxsize=256)
+def _extract_json_payload(text):
+    """Memoized fence-strip + brace-scan; the same raw reply recurs across reruns."""
+    clean = _FENCE_RE.sub("", text).strip()
+    start = clean.find("{")
+    end = clean.rfind("}") + 1
+    if start != -1 and end != -1:
+        clean = clean[start:end]
+    return clean
+
+# Prompt skeletons are parsed once at import; each call only substitutes the
+# variable slots instead of reallocating the multi-KB literals via f-strings.
+_INVESTIGATOR_TPL = Template("""
+        You are a Data Investigator.
+        User Query: "$query"
+        Schema: $schema
+        Context: $ctx
+
+        Task:
+        - If the user asks for a visualization/chart update, return "ACTION: UPDATE_DASHBOARD".
+        - If the user asks for a summary or report, return "ACTION: SUMMARIZE".
+        - If the user asks a factual question about the data (e.g., "Which stock is most volatile?", "Why is sales down?"), write the SQL query to fetch the answer.
+
+        Output ONLY one of:
+        - "ACTION: UPDATE_DASHBOARD"
+        - "ACTION: SUMMARIZE"
+        - The SQL Query itself (DuckDB format)
+        """)
+
+_RESPONDER_TPL = Template("""
+        You are the Stallion Co-Pilot (Enterprise Edition).
+
+        DATABASE SCHEMA:
+        $schema
+
+        CURRENT DASHBOARD JSON:
+        $config
+
+        USER FOCUS: $ctx
+
+        $data  <-- CRITICAL: USE THIS REAL DATA TO ANSWER!
+
+        USER COMMAND: "$query"
+
+        INSTRUCTIONS:
+        1. IF action is 'update_dashboard': Return JSON with "response_type": "update_dashboard" and full config.
+        2. IF action is 'summarize': Return JSON with "response_type": "update_executive_summary" and a rich HTML summary string in "content".
+        3. IF action is 'text_answer': Provide a HIGHLY ANALYTICAL answer based on the DATA INSIGHTS provided above.
+           - Do not just state numbers; explain *why* (e.g., "Tesla is most volatile (5.4%), likely due to the recent earnings call...").
+           - Be professional and conclusive.
+
+        OUTPUT FORMAT (Strict JSON):
+        {
+            "response_type": "update_dashboard" | "text_answer" | "update_executive_summary",
+            "content": "string_or_json",
+            "suggestions": ["Next Step 1", "Next Step 2"]
+        }
+        """)
 
 class StallionCopilot:
     """
@@ -18,39 +129,78 @@ class StallionCopilot:
         self.api_key = api_key
         self.model = model
         self.db = db_engine
+        # Clients are built once and reused: per-call construction re-created
+        # TLS connection pools, adding a handshake to every request
+        self._openai = None
+        self._openai_async = None
+        self._gemini = None
+
+    # Provider SDKs are imported on first client build, not at module import:
+    # sys.modules caches them afterwards, and pages that never call the LLM
+    # (or use the other provider) skip the SDK's import cost entirely.
+    def _openai_client(self):
+        if self._openai is None:
+            import openai
+            self._openai = openai.OpenAI(api_key=self.api_key, timeout=LLM_TIMEOUT, max_retries=LLM_MAX_RETRIES)
+        return self._openai
+
+    def _openai_async_client(self):
+        if self._openai_async is None:
+            import openai
+            self._openai_async = openai.AsyncOpenAI(api_key=self.api_key, timeout=LLM_TIMEOUT, max_retries=LLM_MAX_RETRIES)
+        return self._openai_async
 
-    def process_query(self, user_query, current_config, schema_metadata, focused_context=None):
+    def _gemini_model(self):
+        if self._gemini is None:
+            import google.generativeai as genai
+            genai.configure(api_key=self.api_key)
+            self._gemini = genai.GenerativeModel(self.model)
+        return self._gemini
+
+    def process_query(self, user_query, config_json, schema_metadata, focused_context=None):
         """
         Executes a 2-step Reasoning Loop:
         Step 1: Investigator (Should I run SQL?)
         Step 2: Responder (Answer using the SQL data or update dashboard)
         """
         
+        schema_metadata = _compact_schema(schema_metadata)
+
         # --- STEP 1: THE INVESTIGATOR ---
         # Ask AI if it needs data to answer.
-        investigator_prompt = f"""
-        You are a Data Investigator.
-        User Query: "{user_query}"
-        Schema: {schema_metadata}
-        Context: {focused_context}
-        
-        Task: 
-        - If the user asks for a visualization/chart update, return "ACTION: UPDATE_DASHBOARD".
-        - If the user asks for a summary or report, return "ACTION: SUMMARIZE".
-        - If the user asks a factual question about the data (e.g., "Which stock is most volatile?", "Why is sales down?"), write the SQL query to fetch the answer.
-        
-        Output ONLY one of:
-        - "ACTION: UPDATE_DASHBOARD"
-        - "ACTION: SUMMARIZE"
-        - The SQL Query itself (DuckDB format)
-        """
-        
-        pre_response = self._call_ai(investigator_prompt).strip()
+        investigator_prompt = _INVESTIGATOR_TPL.substitute(
+            query=user_query, schema=schema_metadata, ctx=focused_context
+        )
         
+        # Speculative execution: the responder only depends on SQL results when the
+        # investigator picks SQL. Fire both calls concurrently and keep the
+        # speculative answer for the (common) no-SQL branches, halving latency there.
+        speculative_prompt = self._responder_prompt(user_query, config_json, schema_metadata, focused_context, "")
+
+        async def _speculate():
+            inv_task = asyncio.create_task(self._acall_ai(investigator_prompt))
+            # Same report-size budget as the real responder call below
+            spec_task = asyncio.create_task(self._acall_ai(speculative_prompt, max_tokens=LLM_MAX_REPORT_TOKENS))
+            pre = await inv_task
+            if "SELECT" in pre.upper() and "ACTION" not in pre:
+                spec_task.cancel()  # Wrong guess: real responder needs the SQL results
+                return pre, None
+            try:
+                return pre, await spec_task
+            except asyncio.CancelledError:
+                return pre, None
+
+        try:
+            pre_response, speculative_response = asyncio.run(_speculate())
+        except Exception:
+            # Async path unavailable (e.g. already inside a loop): fall back to sequential
+            pre_response, speculative_response = self._call_ai(investigator_prompt), None
+        pre_response = pre_response.strip()
+
         # --- STEP 2: EXECUTION ---
         data_context = ""
         action_type = "text_answer" # Default
-        
+
         # CASE A: AI wants to run SQL to get facts
         if "SELECT" in pre_response.upper() and "ACTION" not in pre_response:
             try:
@@ -58,8 +208,10 @@ class StallionCopilot:
                 df_result, err = self.db.run_query(clean_sql)
                 
                 if not df_result.empty:
-                    # Limit context to top 10 rows to save tokens
-                    csv_preview = df_result.head(10).to_markdown(index=False)
+                    # Top 10 rows as CSV: ~3x fewer prompt tokens than a markdown
+                    # table, no tabulate formatting pass. round(3) keeps floats
+                    # from eating 15 digits; hard cap guards pathological widths.
+                    csv_preview = df_result.head(10).round(3).to_csv(index=False, lineterminator='\n')[:4000]
                     data_context = f"\n[INTERNAL DATA INVESTIGATION]\nSQL Executed: {clean_sql}\nResult Preview:\n{csv_preview}\n"
                 else:
                     data_context = "\n[INTERNAL DATA INVESTIGATION]\nQuery returned no results."
@@ -75,38 +227,16 @@ class StallionCopilot:
             action_type = "summarize"
 
         # --- STEP 3: THE RESPONDER ---
-        system_prompt = f"""
-        You are the Stallion Co-Pilot (Enterprise Edition).
-        
-        DATABASE SCHEMA:
-        {schema_metadata}
-        
-        CURRENT DASHBOARD JSON:
-        {json.dumps(current_config)}
-        
-        USER FOCUS: {focused_context}
-        
-        {data_context}  <-- CRITICAL: USE THIS REAL DATA TO ANSWER!
-        
-        USER COMMAND: "{user_query}"
-        
-        INSTRUCTIONS:
-        1. IF action is 'update_dashboard': Return JSON with "response_type": "update_dashboard" and full config.
-        2. IF action is 'summarize': Return JSON with "response_type": "update_executive_summary" and a rich HTML summary string in "content".
-        3. IF action is 'text_answer': Provide a HIGHLY ANALYTICAL answer based on the DATA INSIGHTS provided above. 
-           - Do not just state numbers; explain *why* (e.g., "Tesla is most volatile (5.4%), likely due to the recent earnings call...").
-           - Be professional and conclusive.
-        
-        OUTPUT FORMAT (Strict JSON):
-        {{
-            "response_type": "update_dashboard" | "text_answer" | "update_executive_summary",
-            "content": "string_or_json",
-            "suggestions": ["Next Step 1", "Next Step 2"]
-        }}
-        """
-        
         try:
-            final_response = self._call_ai(system_prompt)
+            if speculative_response is not None:
+                # The prefetched answer is already valid (no data_context was needed)
+                return self._clean_json(speculative_response)
+            system_prompt = self._responder_prompt(user_query, config_json, schema_metadata, focused_context, data_context)
+            # Stream the responder (the long output) and buffer chunks for parsing:
+            # generation overlaps network transfer instead of waiting for the last token.
+            # The investigator above stays non-streaming — its output is a few tokens.
+            # Report-size budget: the responder may emit a full dashboard config
+            final_response = "".join(self.stream_ai(system_prompt, max_tokens=LLM_MAX_REPORT_TOKENS))
             return self._clean_json(final_response)
         except Exception as e:
             return {
@@ -115,40 +245,142 @@ class StallionCopilot:
                 "suggestions": ["Try simpler query"]
             }
 
-    def generate_chart_insight(self, df, title):
+    def _responder_prompt(self, user_query, config_json, schema_metadata, focused_context, data_context):
+        # config_json arrives pre-serialized (see state_manager.set_dashboard_config):
+        # the dict is only walked once per write, not once per chat turn
+        if not isinstance(config_json, str):
+            config_json = json.dumps(config_json, separators=(',', ':'))
+        return _RESPONDER_TPL.substitute(
+            query=user_query, config=config_json, schema=schema_metadata,
+            ctx=focused_context, data=data_context
+        )
+
+    def generate_chart_insight(self, df, title, stream=False):
         """
         Specialized method for the 'Analyze this Chart' button.
+        With stream=True returns a chunk generator for st.write_stream.
         """
-        stats = df.describe().to_markdown()
+        # Compact JSON stats: 3-5x fewer prompt tokens than a markdown table,
+        # and big frames are sampled before describe()
+        if len(df) > 10_000:
+            df = df.sample(n=10_000, random_state=42)
+        stats = json.dumps(df.describe().round(2).to_dict(), separators=(',', ':'), default=str)
         prompt = f"""
         Analyze this chart data for "{title}".
         Stats:
         {stats}
-        
+
         Provide 3 bullet points:
         1. Observation (What is happening?)
         2. Insight (Why is it significant?)
         3. Recommendation (What to do?)
         """
+        if stream:
+            return self.stream_ai(prompt)
         return self._call_ai(prompt)
 
+    async def _acall_ai(self, prompt, max_tokens=LLM_MAX_OUTPUT_TOKENS):
+        """Async twin of _call_ai. Lets independent prompts share the wait instead of serializing."""
+        if self.provider == "Google Gemini":
+            resp = await self._gemini_model().generate_content_async(
+                prompt,
+                generation_config={"max_output_tokens": max_tokens},
+                request_options={"timeout": LLM_TIMEOUT}
+            )
+            return resp.text
+        else:
+            resp = await self._openai_async_client().chat.completions.create(
+                model=self.model,
+                messages=[{"role": "system", "content": prompt}],
+                max_tokens=max_tokens
+            )
+            return resp.choices[0].message.content
+
+    async def _athrottled_call(self, prompt, semaphore):
+        """Caps provider concurrency and backs off exponentially on transient failures (429s etc.)."""
+        async with semaphore:
+            for attempt in range(LLM_MAX_RETRIES):
+                try:
+                    return await self._acall_ai(prompt)
+                except Exception:
+                    if attempt == LLM_MAX_RETRIES - 1:
+                        raise
+                    await asyncio.sleep(2 ** attempt + random.random())
+
+    def batch_call_ai(self, prompts):
+        """Fires several independent prompts concurrently. Returns responses in input order."""
+        async def _run():
+            # Semaphore is created inside the loop asyncio.run spins up
+            semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+            return await asyncio.gather(*(self._athrottled_call(p, semaphore) for p in prompts))
+        return asyncio.run(_run())
+
+    def stream_ai(self, prompt, max_tokens=LLM_MAX_OUTPUT_TOKENS):
+        """Yields response chunks as they arrive. Pair with st.write_stream so the
+        first tokens paint in <500ms instead of waiting for the full completion.
+        Long-form callers (reports, dashboard configs) pass a bigger max_tokens."""
+        if self.provider == "Google Gemini":
+            for chunk in self._gemini_model().generate_content(
+                prompt,
+                stream=True,
+                generation_config={"max_output_tokens": max_tokens},
+                request_options={"timeout": LLM_TIMEOUT}
+            ):
+                if chunk.text: yield chunk.text
+        else:
+            stream = self._openai_client().chat.completions.create(
+                model=self.model,
+                messages=[{"role": "system", "content": prompt}],
+                max_tokens=max_tokens,
+                stream=True
+            )
+            for chunk in stream:
+                delta = chunk.choices[0].delta.content
+                if delta: yield delta
+
     def _call_ai(self, prompt):
+        # Cache first (identical prompts replay free), then route misses through the
+        # process-wide micro-batcher so concurrent sessions share one provider call.
+        # Misses also consult/refill the sqlite cache, so plans and reports
+        # survive Streamlit restarts.
+        batcher = get_batcher((self.provider, self.model, self.api_key), self._provider_call)
+        prompt_hash = hashlib.sha256(f"{self.provider}|{self.model}|{prompt}".encode()).hexdigest()
+
+        def _invoke():
+            disk = get_ai_cache()
+            hit = disk.lookup(prompt_hash)
+            if hit is not None:
+                return hit
+            resp = batcher.submit(prompt)
+            disk.store(prompt_hash, resp)
+            return resp
+
+        return _call_ai_cached(self.provider, self.model, prompt_hash, _invoke)
+
+    def _provider_call(self, prompt):
         if self.provider == "Google Gemini":
-            genai.configure(api_key=self.api_key)
-            model = genai.GenerativeModel(self.model)
-            return model.generate_content(prompt).text
+            return self._gemini_model().generate_content(
+                prompt,
+                generation_config={"max_output_tokens": LLM_MAX_OUTPUT_TOKENS},
+                request_options={"timeout": LLM_TIMEOUT}
+            ).text
         else:
-            client = openai.OpenAI(api_key=self.api_key)
-            resp = client.chat.completions.create(
+            resp = self._openai_client().chat.completions.create(
                 model=self.model,
-                messages=[{"role": "system", "content": prompt}]
+                messages=[{"role": "system", "content": prompt}],
+                max_tokens=LLM_MAX_OUTPUT_TOKENS
             )
             return resp.choices[0].message.content
 
     def _clean_json(self, text):
-        clean = text.replace("```json", "").replace("```", "").strip()
-        start = clean.find("{")
-        end = clean.rfind("}") + 1
-        if start != -1 and end != -1:
-            clean = clean[start:end]
-        return json.loads(clean)
\ No newline at end of file
+        # Parse is per-call (callers mutate the dicts); only the scan is memoized
+        return json.loads(_extract_json_payload(text))
+
+
+@st.cache_resource(show_spinner=False)
+def get_shared_copilot(provider, model, key_fingerprint, db_token, _api_key, _db):
+    """Process-cached agent per (provider, model, key, engine): repeat callers
+    reuse the warm clients and TLS pools instead of rebuilding them per click.
+    The API key enters the cache key only as its SHA-256 fingerprint so the
+    secret never shows up in Streamlit's cache inspector."""
+    return StallionCopilot(provider, _api_key, model, _db)
\ No newline at end of file
@@ -1,7 +1,9 @@
 import duckdb
+import os
 import pandas as pd
 import streamlit as st
 import re
+import tempfile
 
 class StallionDB:
     """
@@ -12,43 +14,95 @@ class StallionDB:
     def __init__(self):
         # In-memory database for the session
         self.conn = duckdb.connect(database=':memory:')
+        # Explicit knobs: use every core for scans/aggregations, cap RAM, and
+        # give oversized intermediates somewhere to spill instead of erroring
+        try:
+            self.conn.execute(f"PRAGMA threads={os.cpu_count()}")
+            self.conn.execute("PRAGMA memory_limit='8GB'")
+            self.conn.execute(f"PRAGMA temp_directory='{os.path.join(tempfile.gettempdir(), 'duckdb_tmp')}'")
+        except Exception:
+            pass  # Defaults still work if a PRAGMA is unavailable
         self.table_names = []
+        self._schema_cache = None  # Memoized get_schema() output, reset on ingest
 
     def ingest_data(self, uploaded_files):
         """
-        Streams multiple files into DuckDB tables.
+        Loads multiple uploads into DuckDB tables without touching disk:
+        each buffer is parsed into a pyarrow Table (multi-threaded SIMD
+        readers) and registered with DuckDB, which consumes Arrow with
+        buffer reuse — no temp file write/read round-trip.
         Returns: (Error_String, Success_Message_String)
         """
+        import pyarrow as pa
+        import pyarrow.csv, pyarrow.json, pyarrow.parquet
+
         self.table_names = [] # Reset table list
+        self._schema_cache = None
         messages = []
-        
+
         # Ensure input is a list (Streamlit returns a single object if only 1 file, unless accept_multiple_files=True is handled carefully)
         if not isinstance(uploaded_files, list):
             uploaded_files = [uploaded_files]
 
         try:
+            parsed = []
             for file in uploaded_files:
                 # Sanitize table name (remove extension, spaces -> underscores, lowercase)
                 clean_name = re.sub(r'\W+', '_', file.name.split('.')[0]).lower()
-                
-                # Save temp file for DuckDB to read
-                file_path = f"temp_{clean_name}"
-                with open(file_path, "wb") as f:
-                    f.write(file.getbuffer())
+
+                file.seek(0)
+                reader = pa.BufferReader(pa.py_buffer(file.read()))
 
                 # Determine loader based on extension
                 if file.name.endswith('.csv'):
-                    query = f"CREATE OR REPLACE TABLE {clean_name} AS SELECT * FROM read_csv_auto('{file_path}', normalize_names=True)"
+                    tbl = pyarrow.csv.read_csv(reader)
                 elif file.name.endswith('.json'):
-                    query = f"CREATE OR REPLACE TABLE {clean_name} AS SELECT * FROM read_json_auto('{file_path}')"
+                    try:
+                        # pyarrow's JSON reader only speaks NDJSON
+                        tbl = pyarrow.json.read_json(reader)
+                    except Exception:
+                        # Plain JSON array: let DuckDB's reader parse it
+                        file.seek(0)
+                        tbl = self.conn.read_json(file).fetch_arrow_table()
                 elif file.name.endswith('.parquet'):
-                    query = f"CREATE OR REPLACE TABLE {clean_name} AS SELECT * FROM read_parquet('{file_path}')"
+                    tbl = pyarrow.parquet.read_table(reader)
                 else:
                     return f"Unsupported format: {file.name}", None
 
-                self.conn.execute(query)
+                # Metadata-only rename keeps the old normalize_names=True
+                # behaviour; suffix collisions (e.g. 'a b' vs 'a_b') since
+                # Arrow rejects duplicate column names
+                renamed, seen = [], set()
+                for c in tbl.column_names:
+                    name = re.sub(r'\W+', '_', c).strip('_').lower() or 'col'
+                    base, i = name, 0
+                    while name in seen:
+                        i += 1
+                        name = f"{base}_{i}"
+                    seen.add(name)
+                    renamed.append(name)
+                tbl = tbl.rename_columns(renamed)
+                parsed.append((clean_name, tbl))
+
+            # Same-schema uploads (e.g. monthly exports of one report) union
+            # into a single table in one shot instead of N serialized loads;
+            # distinct schemas keep their own tables so joins still work
+            groups = {}
+            for name, tbl in parsed:
+                key = tuple(zip(tbl.column_names, map(str, tbl.schema.types)))
+                groups.setdefault(key, []).append((name, tbl))
+
+            for members in groups.values():
+                clean_name = members[0][0]
+                tbl = members[0][1] if len(members) == 1 else pa.concat_tables(t for _, t in members)
+                self.conn.register("tmp_arrow", tbl)
+                self.conn.execute(f"CREATE OR REPLACE TABLE {clean_name} AS SELECT * FROM tmp_arrow")
+                self.conn.unregister("tmp_arrow")
                 self.table_names.append(clean_name)
-                messages.append(clean_name)
+                if len(members) > 1:
+                    messages.append(f"{clean_name} (merged {len(members)} files)")
+                else:
+                    messages.append(clean_name)
 
             return None, f"Successfully loaded tables: {', '.join(messages)}"
 
@@ -58,30 +112,71 @@ class StallionDB:
     def get_schema(self):
         """
         Returns schema for ALL loaded tables to help AI find Joins.
+        Memoized per ingest: tables only change via ingest_data, so the
+        DESCRIBE round-trips run once instead of on every rerun/prompt.
         """
-        full_schema = ""
+        if self._schema_cache is not None:
+            return self._schema_cache
         try:
             if not self.table_names:
                 return "No tables loaded."
-                
+
+            # fetchall gives plain tuples: no DataFrame build, no iterrows
+            # boxing, and join instead of O(n^2) string concatenation
+            parts = []
             for table in self.table_names:
-                df_schema = self.conn.execute(f"DESCRIBE {table}").df()
-                full_schema += f"\nTABLE: {table}\nCOLUMNS:\n"
-                for _, row in df_schema.iterrows():
-                    full_schema += f"- {row['column_name']} ({row['column_type']})\n"
-            return full_schema
+                cols = self.conn.execute(f"DESCRIBE {table}").fetchall()
+                parts.append(f"\nTABLE: {table}\nCOLUMNS:\n")
+                parts.append("\n".join(f"- {c[0]} ({c[1]})" for c in cols) + "\n")
+            self._schema_cache = "".join(parts)
+            return self._schema_cache
         except:
             return "Error retrieving schema."
 
-    def run_query(self, sql_query):
+    def run_query(self, sql_query, params=None):
         """
         Executes an SQL query and returns the result as a Pandas DataFrame.
+        Optional params are bound as prepared-statement parameters.
         """
         try:
-            return self.conn.execute(sql_query).df(), None
+            return self.conn.execute(sql_query, params).df(), None
         except Exception as e:
             return pd.DataFrame(), str(e)
+
+    def run_query_arrow(self, sql_query, params=None):
+        """
+        Executes an SQL query and returns a pyarrow Table. Skips the
+        Arrow->pandas conversion (which copies strings/objects) for consumers
+        like st.dataframe that render Arrow directly.
+        """
+        try:
+            return self.conn.execute(sql_query, params).fetch_arrow_table(), None
+        except Exception as e:
+            return None, str(e)
             
+    def rfm_aggregate(self, id_col, date_col, amount_col, table=None):
+        """
+        Computes Recency/Frequency/Monetary per entity inside DuckDB.
+        Returns ~one row per entity instead of shipping raw transactions
+        to pandas for a Python-side groupby. Entities with non-positive
+        Monetary (refund-heavy accounts) are dropped like the old pandas
+        clean did — log1p on sums <= -1 would NaN out the clustering.
+        """
+        if not self.table_names:
+            return pd.DataFrame(), "No tables loaded."
+        table = table or self.table_names[0]
+        sql = f"""
+            SELECT {id_col},
+                   DATE_DIFF('day', MAX({date_col}), (SELECT MAX({date_col}) + INTERVAL 1 DAY FROM {table})) AS Recency,
+                   COUNT(*) AS Frequency,
+                   SUM({amount_col}) AS Monetary
+            FROM {table}
+            WHERE {date_col} IS NOT NULL AND {amount_col} IS NOT NULL
+            GROUP BY {id_col}
+            HAVING SUM({amount_col}) > 0
+        """
+        return self.run_query(sql)
+
     def get_sample(self, limit=5):
         """Returns sample of the first table loaded."""
         if self.table_names:
@@ -1,12 +1,8 @@
 import pandas as pd
 import numpy as np
 from statsmodels.tsa.holtwinters import ExponentialSmoothing
-from sklearn.linear_model import LinearRegression
 import warnings
 
-# Suppress statsmodels warnings for cleaner logs
-warnings.filterwarnings("ignore")
-
 class StallionForecaster:
     """
     The Agentic Forecasting Engine.
@@ -25,38 +21,43 @@ class StallionForecaster:
         Returns: (forecast_df, model_info_string)
         """
         try:
-            # 1. Data Preparation
-            data = df.copy()
-            # Attempt to convert to datetime
-            data[x_col] = pd.to_datetime(data[x_col], errors='coerce')
-            data = data.dropna(subset=[x_col])
-            data = data.sort_values(by=x_col)
-            
-            if data.empty:
+            # 1. Data Preparation — aggregate where the data lives. DuckDB's
+            # multi-threaded hash aggregate collapses raw history to one row
+            # per bucket before pandas ever sees it (the old path copied the
+            # whole frame, parsed/sorted every row, then grouped in Python).
+            # TRY_CAST mirrors the old errors='coerce' date parsing.
+            import duckdb
+            con = duckdb.connect()
+            # Register only the two columns the forecast reads — the scan
+            # never touches the rest of a wide frame
+            con.register('src', df[[x_col, y_col]])
+
+            n_valid = con.execute(
+                f'SELECT COUNT(*) FROM src WHERE TRY_CAST("{x_col}" AS TIMESTAMP) IS NOT NULL'
+            ).fetchone()[0]
+            if n_valid == 0:
                 return None, "Invalid Date Column"
 
-            # Resample to ensure regular intervals
             # Heuristic: If > 60 points, assume Daily/Weekly, else Monthly
-            # We aggregate by sum to handle duplicates
-            if len(data) > 60:
-                freq = 'D'
-                cycle = 7 # Weekly seasonality
+            if n_valid > 60:
+                freq, cycle, unit = 'D', 7, 'day'   # Weekly seasonality
             else:
-                # Use 'ME' for Month End in newer pandas, fallback to 'M'
-                freq = 'M' 
-                cycle = 12 # Yearly seasonality
-            
-            # Group and fill gaps
-            ts_data = data.groupby(x_col)[y_col].sum()
-            
-            # Infer frequency if possible, else force our heuristic
-            if not ts_data.index.freq:
-                try:
-                    ts_data = ts_data.asfreq(freq, method='ffill').fillna(0)
-                except:
-                    # Fallback for messy dates: Use index as 0,1,2...
-                    pass
-            
+                # Month End (modern pandas; 'M' was removed), yearly seasonality
+                freq, cycle, unit = 'ME', 12, 'month'
+
+            agg = con.execute(f"""
+                SELECT date_trunc('{unit}', TRY_CAST("{x_col}" AS TIMESTAMP)) AS t,
+                       SUM(TRY_CAST("{y_col}" AS DOUBLE)) AS v
+                FROM src
+                WHERE TRY_CAST("{x_col}" AS TIMESTAMP) IS NOT NULL
+                GROUP BY t ORDER BY t
+            """).df()
+
+            # Tiny frame now: resample (not asfreq — date_trunc('month')
+            # stamps month STARTS, which 'ME' asfreq would drop outright)
+            # regularizes the grid and zero-fills gap buckets
+            ts_data = agg.set_index('t')['v'].resample(freq).sum().fillna(0)
+
             # 2. Model Selection Logic (Agentic Decision)
             # Need at least 2 full cycles for seasonal models
             use_seasonality = len(ts_data) >= (cycle * 2)
@@ -66,13 +67,21 @@ class StallionForecaster:
             if use_seasonality:
                 try:
                     # Holt-Winters (Trend + Seasonality)
-                    model = ExponentialSmoothing(
-                        ts_data, 
-                        trend='add', 
-                        seasonal='add', 
-                        seasonal_periods=cycle
-                    ).fit()
-                    forecast_values = model.forecast(periods)
+                    # use_brute=False skips the grid search over initial
+                    # states (the dominant cost on long series); L-BFGS-B
+                    # converges from the heuristic start in a few iterations.
+                    # Warning suppression is scoped to the fit — the old
+                    # module-level ignore hid the pandas deprecations that
+                    # silently broke the 'M' frequency.
+                    with warnings.catch_warnings():
+                        warnings.simplefilter("ignore")
+                        model = ExponentialSmoothing(
+                            ts_data,
+                            trend='add',
+                            seasonal='add',
+                            seasonal_periods=cycle
+                        ).fit(method='L-BFGS-B', use_brute=False)
+                        forecast_values = model.forecast(periods)
                     model_name = f"Holt-Winters (Seasonal period={cycle})"
                 except:
                     # Fallback if HW fails
@@ -80,13 +89,11 @@ class StallionForecaster:
             
             if not use_seasonality:
                 # Simple Linear Trend (Robust fallback)
-                # Convert dates to ordinal for regression
-                X = np.arange(len(ts_data)).reshape(-1, 1)
-                y = ts_data.values
-                reg = LinearRegression().fit(X, y)
-                
-                future_X = np.arange(len(ts_data), len(ts_data) + periods).reshape(-1, 1)
-                pred = reg.predict(future_X)
+                # Closed-form 1D fit: sklearn's LinearRegression added full
+                # pipeline overhead (validation, copies, SVD) for one slope
+                n = len(ts_data)
+                slope, intercept = np.polyfit(np.arange(n), ts_data.values, 1)
+                pred = slope * np.arange(n, n + periods) + intercept
                 
                 # Create Date Index for future
                 last_date = ts_data.index[-1]
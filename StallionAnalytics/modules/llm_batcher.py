@@ -0,0 +1,106 @@
+import queue
+import re
+import threading
+import time
+
+# Prompts arriving within this window share one LLM call
+MAX_WAIT_MS = 75
+MAX_BATCH = 8
+
+_ITEM_HEADER = "=== ITEM {} ==="
+_SPLIT_RE = re.compile(r"^=== ITEM \d+ ===\s*$", re.M)
+
+
+class _Pending:
+    __slots__ = ("prompt", "event", "result", "error")
+
+    def __init__(self, prompt):
+        self.prompt = prompt
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class BatchingLLMClient:
+    """
+    The Dynamic Micro-Batcher.
+    Coalesces prompts that arrive within a short window into one multi-item
+    LLM call (row-marshaled with '=== ITEM n ===' separators, split on reply),
+    so concurrent sessions amortize network and prefill latency instead of
+    each paying the full round-trip.
+    """
+
+    def __init__(self, call_fn, max_wait_ms=MAX_WAIT_MS, max_batch=MAX_BATCH):
+        self._call_fn = call_fn
+        self._max_wait = max_wait_ms / 1000.0
+        self._max_batch = max_batch
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._drain_loop, daemon=True)
+        self._worker.start()
+
+    def submit(self, prompt):
+        """Blocks until this prompt's slice of the (possibly batched) response arrives."""
+        item = _Pending(prompt)
+        self._queue.put(item)
+        item.event.wait()
+        if item.error is not None:
+            raise item.error
+        return item.result
+
+    def _drain_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self._max_wait
+            while len(batch) < self._max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._execute(batch)
+
+    def _execute(self, batch):
+        try:
+            if len(batch) == 1:
+                # Solo request: passes through untouched (no marshaling overhead)
+                batch[0].result = self._call_fn(batch[0].prompt)
+            else:
+                preamble = (
+                    f"Answer each of the {len(batch)} items below independently. "
+                    "Prefix each answer with its own '=== ITEM <n> ===' line, in order.\n\n"
+                )
+                joined = "\n\n".join(
+                    f"{_ITEM_HEADER.format(i)}\n{p.prompt}" for i, p in enumerate(batch)
+                )
+                reply = self._call_fn(preamble + joined)
+                parts = [part.strip() for part in _SPLIT_RE.split(reply) if part.strip()]
+                if len(parts) == len(batch):
+                    for pending, part in zip(batch, parts):
+                        pending.result = part
+                else:
+                    # Marshaling failed (model ignored separators): degrade to per-prompt calls
+                    for pending in batch:
+                        pending.result = self._call_fn(pending.prompt)
+        except Exception as e:
+            for pending in batch:
+                if pending.result is None:
+                    pending.error = e
+        finally:
+            for pending in batch:
+                pending.event.set()
+
+
+# Process-wide registry: all sessions hitting the same backend share one window
+_batchers = {}
+_registry_lock = threading.Lock()
+
+
+def get_batcher(key, call_fn):
+    """Returns the shared batcher for a (provider, model, api_key) backend key."""
+    with _registry_lock:
+        batcher = _batchers.get(key)
+        if batcher is None:
+            batcher = _batchers[key] = BatchingLLMClient(call_fn)
+        return batcher
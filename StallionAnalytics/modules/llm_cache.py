@@ -0,0 +1,65 @@
+import re
+import numpy as np
+
+# Optional: MiniLM embeddings give true semantic matching ("sales by region"
+# ~ "sales per region"). Without the package we degrade to normalized
+# exact-match so the cache still catches retries and copy-paste repeats.
+try:
+    from sentence_transformers import SentenceTransformer
+    _HAS_EMBEDDER = True
+except ImportError:
+    _HAS_EMBEDDER = False
+
+
+class SemanticCache:
+    """
+    The GenerativeCache layer for the Co-Pilot.
+    Short-circuits near-identical prompts so repeat questions skip the LLM entirely.
+    Keeps an in-process matrix of prompt embeddings and cosine-matches new prompts
+    against it; held in st.cache_resource by the app so it survives reruns.
+    """
+
+    def __init__(self, threshold=0.93):
+        self.threshold = threshold
+        self.embedder = SentenceTransformer("all-MiniLM-L6-v2") if _HAS_EMBEDDER else None
+        self._embeddings = None   # (N, dim) float32, L2-normalized rows
+        self._entries = []        # parallel list of (scope, normalized_prompt, result)
+
+    @staticmethod
+    def _normalize(prompt):
+        return re.sub(r"\s+", " ", prompt).strip().lower()
+
+    def _embed(self, prompt):
+        vec = self.embedder.encode([prompt])[0].astype(np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def lookup(self, prompt, scope=None, threshold=None):
+        """Returns the cached result for a semantically similar prompt, or None.
+
+        The instance is process-wide, but answers depend on which dataset (and
+        focus context) produced them — scope partitions the cache so a new
+        upload or another session never replays stale answers."""
+        if not self._entries:
+            return None
+        normalized = self._normalize(prompt)
+        if self.embedder is None:
+            for cached_scope, cached_prompt, result in self._entries:
+                if cached_scope == scope and cached_prompt == normalized:
+                    return result
+            return None
+        sims = self._embeddings @ self._embed(normalized)
+        # Only entries from the same scope are eligible matches
+        sims = np.where([e[0] == scope for e in self._entries], sims, -1.0)
+        best = int(np.argmax(sims))
+        if sims[best] >= (threshold if threshold is not None else self.threshold):
+            return self._entries[best][2]
+        return None
+
+    def store(self, prompt, result, scope=None):
+        """Records a (prompt, result) pair for future lookups within a scope."""
+        normalized = self._normalize(prompt)
+        self._entries.append((scope, normalized, result))
+        if self.embedder is not None:
+            vec = self._embed(normalized).reshape(1, -1)
+            self._embeddings = vec if self._embeddings is None else np.vstack([self._embeddings, vec])
@@ -1,7 +1,7 @@
-import openai
-import google.generativeai as genai
 import json
 
+from modules.copilot import LLM_TIMEOUT, LLM_MAX_RETRIES, LLM_MAX_REPORT_TOKENS, _compact_schema
+
 class DashboardBrain:
     """
     The SQL-Aware Intelligence Layer.
@@ -12,7 +12,13 @@ class DashboardBrain:
         self.provider = provider
         self.api_key = api_key
         self.model = model
+        # Reused clients: rebuilding them per call re-established TLS pools.
+        # SDKs import lazily on first use so the other provider's package
+        # never loads.
+        self._openai = None
+        self._gemini = None
         if provider == "Google Gemini" and api_key:
+            import google.generativeai as genai
             genai.configure(api_key=api_key)
 
     def suggest_intents(self, schema_metadata):
@@ -27,10 +33,10 @@ class DashboardBrain:
         RULES:
         1. Focus on "Business Value" (e.g., "Customer Churn Analysis", "Inventory Turnover", "Seasonal Sales Trends").
         2. Avoid generic titles like "Data Overview". Go for specific insights like "Cohort Analysis" or "Pareto Distribution".
-        3. Return ONLY a JSON list of strings. No markdown.
-        
+        3. Return ONLY a JSON object with a "suggestions" list of strings. No markdown.
+
         Example Output:
-        ["Sales Performance by Region", "Customer Acquisition Cost Analysis", "Quarterly Revenue Trends", ...]
+        {"suggestions": ["Sales Performance by Region", "Customer Acquisition Cost Analysis", "Quarterly Revenue Trends", ...]}
         """
         
         user_message = f"""
@@ -46,7 +52,9 @@ class DashboardBrain:
             else:
                 response = self._call_openai(system_prompt, user_message)
             
-            # Ensure it's a list
+            # JSON mode returns an object wrapper; accept a bare list too
+            if isinstance(response, dict) and isinstance(response.get("suggestions"), list):
+                return response["suggestions"]
             if isinstance(response, list):
                 return response
             else:
@@ -97,15 +105,18 @@ class DashboardBrain:
         2. Aggregations: Always GROUP BY when using SUM/AVG/COUNT in charts.
         3. Limits: Always add 'LIMIT 100' to chart queries to prevent browser crashes.
         4. KPI Queries: Must return exactly ONE row and ONE column (a single value).
+        5. Filters: In every query, put 'WHERE 1=1 {filters}' directly on the scan of source_data
+           (before any GROUP BY). The literal token {filters} is replaced with user drill-down
+           predicates at render time. Example: "SELECT region, SUM(sales) AS total_sales FROM source_data WHERE 1=1 {filters} GROUP BY region".
         """
         
         user_message = f"""
         DATABASE SCHEMA:
-        {schema_metadata}
-        
+        {_compact_schema(schema_metadata)}
+
         USER INTENT:
         {user_intent}
-        
+
         Design the dashboard and write the SQL now.
         """
 
@@ -118,21 +129,44 @@ class DashboardBrain:
             return {"error": f"AI Generation Failed: {str(e)}"}
 
     def _call_gemini(self, sys, user):
-        model = genai.GenerativeModel(self.model if self.model else "gemini-2.5-pro")
-        resp = model.generate_content(f"{sys}\n\nUSER: {user}")
-        return self._clean_json(resp.text)
+        if self._gemini is None:
+            import google.generativeai as genai
+            self._gemini = genai.GenerativeModel(self.model if self.model else "gemini-2.5-pro")
+        # Native JSON mode (no fences, no parse retries) + streaming: chunks
+        # are buffered as they arrive, so generation overlaps network transfer
+        # instead of waiting for the last token
+        stream = self._gemini.generate_content(
+            f"{sys}\n\nUSER: {user}",
+            stream=True,
+            generation_config={
+                # Dashboard configs run to several KB of JSON; the default cap truncates them
+                "max_output_tokens": LLM_MAX_REPORT_TOKENS,
+                "response_mime_type": "application/json",
+                "temperature": 0.2,
+            },
+            request_options={"timeout": LLM_TIMEOUT}
+        )
+        return self._clean_json("".join(chunk.text for chunk in stream if chunk.text))
 
     def _call_openai(self, sys, user):
-        client = openai.OpenAI(api_key=self.api_key)
-        resp = client.chat.completions.create(
+        if self._openai is None:
+            import openai
+            self._openai = openai.OpenAI(api_key=self.api_key, timeout=LLM_TIMEOUT, max_retries=LLM_MAX_RETRIES)
+        stream = self._openai.chat.completions.create(
             model=self.model if self.model else "gpt-3.5-turbo",
-            messages=[{"role": "system", "content": sys}, {"role": "user", "content": user}]
+            messages=[{"role": "system", "content": sys}, {"role": "user", "content": user}],
+            max_tokens=LLM_MAX_REPORT_TOKENS,
+            response_format={"type": "json_object"},
+            stream=True
         )
-        return self._clean_json(resp.choices[0].message.content)
+        return self._clean_json("".join(
+            chunk.choices[0].delta.content for chunk in stream
+            if chunk.choices and chunk.choices[0].delta.content
+        ))
 
     def _clean_json(self, text):
-        clean = text.replace("```json", "").replace("```", "").strip()
+        # JSON mode guarantees valid JSON; no fence stripping needed
         try:
-            return json.loads(clean)
+            return json.loads(text)
         except:
             return {"error": "Invalid JSON returned."}
\ No newline at end of file
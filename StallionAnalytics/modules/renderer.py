@@ -1,10 +1,162 @@
+import hashlib
+import re
 import streamlit as st
 import plotly.express as px
 import plotly.graph_objects as go
+import plotly.io as pio
+import numpy as np
 import pandas as pd
+from pandas.api.types import is_datetime64_any_dtype
+
+# House style registered once as a Plotly template: figures pick it up by
+# name at construction, instead of update_layout deep-copying and
+# re-validating the same dict for every chart on every rerun
+pio.templates["stallion"] = go.layout.Template(layout=dict(
+    paper_bgcolor='rgba(0,0,0,0)',
+    plot_bgcolor='rgba(0,0,0,0)',
+    font=dict(color='#fafafa'),
+    margin=dict(t=30, l=10, r=10, b=10),
+    xaxis=dict(showgrid=False),
+    yaxis=dict(showgrid=True, gridcolor='rgba(255,255,255,0.1)')
+))
+_TEMPLATE = "plotly_dark+stallion"
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+# Anything beyond a plain "SELECT cols FROM table" (aggregates, grouping,
+# existing clauses, subqueries — a '(' catches SUM(...) and nesting) keeps the
+# safe subquery wrap in _inject_filters
+_COMPLEX_SQL = re.compile(r"\b(GROUP\s+BY|HAVING|WHERE|ORDER\s+BY|LIMIT|UNION|JOIN|OVER|DISTINCT)\b|\(", re.IGNORECASE)
+
+@st.cache_data(ttl=300, max_entries=128, show_spinner=False)
+def _fetch_dashboard_data(db_token, fused_kpi_stmt, chart_stmts, _db):
+    """
+    One cached stage for all dashboard SQL, keyed on the exact statements.
+    Each statement is a (sql, params) pair — filter values travel as bound
+    parameters, not interpolated text. Reruns with unchanged filters — e.g.
+    the rerun a chart click triggers — skip DuckDB entirely; on a miss, chart
+    queries run on worker cursors while the fused KPI query executes.
+    """
+    def _one(stmt):
+        sql, params = stmt
+        try:
+            return _db.conn.cursor().execute(sql, list(params) or None).df(), None
+        except Exception as e:
+            return pd.DataFrame(), str(e)
+
+    def _kpi_scalars(stmt):
+        # Arrow transport: the fused row comes back as a pyarrow Table and the
+        # scalars are plucked with .as_py() — no pandas block-manager build
+        sql, params = stmt
+        try:
+            tbl = _db.conn.cursor().execute(sql, list(params) or None).fetch_arrow_table()
+            vals = tuple(col[0].as_py() for col in tbl.columns) if tbl.num_rows else ()
+            return vals, None
+        except Exception as e:
+            return None, str(e)
+
+    chart_futs = []
+    ex = None
+    if chart_stmts:
+        ex = ThreadPoolExecutor(max_workers=min(8, len(chart_stmts)))
+        chart_futs = [ex.submit(_one, stmt) for stmt in chart_stmts]
+    kpi_result = _kpi_scalars(fused_kpi_stmt) if fused_kpi_stmt else (None, None)
+    chart_results = [f.result() for f in chart_futs]
+    if ex: ex.shutdown(wait=False)
+    return kpi_result, chart_results
+
+_MAX_PLOT_POINTS = 2000
+
+# Responsive chart grid, scoped to the keyed container below: charts render
+# in one flat loop and CSS handles the two-column layout (collapsing to one
+# on narrow screens) instead of a per-pair st.columns fan-out
+_GRID_CSS = """<style>
+div.st-key-chart_grid {
+    display: grid;
+    grid-template-columns: repeat(auto-fit, minmax(420px, 1fr));
+    gap: 1rem;
+}
+</style>"""
+
+def _lttb(df, y_col, n_out=_MAX_PLOT_POINTS):
+    """Largest-Triangle-Three-Buckets downsample: keeps the n_out rows that
+    best preserve the visual shape of the series. Plotly ships every row to
+    the browser as JSON, so a 100k-point series pays 50x in payload and
+    paint time for pixels that can't show the difference."""
+    n = len(df)
+    if n <= n_out:
+        return df
+    y = pd.to_numeric(df[y_col], errors="coerce").to_numpy(dtype=np.float64)
+    x = np.arange(n, dtype=np.float64)
+    idx = np.empty(n_out, dtype=np.int64)
+    idx[0], idx[-1] = 0, n - 1
+    every = (n - 2) / (n_out - 2)
+    a = 0
+    for i in range(n_out - 2):
+        r0 = int(i * every) + 1
+        r1 = int((i + 1) * every) + 1
+        nxt = min(int((i + 2) * every) + 1, n)
+        avg_x = x[r1:nxt].mean() if nxt > r1 else x[-1]
+        avg_y = np.nanmean(y[r1:nxt]) if nxt > r1 else y[-1]
+        area = np.abs((x[a] - avg_x) * (y[r0:r1] - y[a]) - (x[a] - x[r0:r1]) * (avg_y - y[a]))
+        a = r0 + int(np.nanargmax(area)) if r1 > r0 else r0
+        idx[i + 1] = a
+    return df.iloc[idx]
+
+@st.cache_data(ttl=300, max_entries=64, show_spinner=False)
+def _build_fig_dict(c_type, data_token, x_col, y_col, color_col, title, _df, _forecast_df, growth):
+    """Builds the chart once per distinct inputs and caches its plain-dict
+    form. Repeat renders (fragment reruns, expander toggles) skip px's
+    per-field validation and figure re-serialization; st.plotly_chart
+    accepts the dict as-is. The frames arrive underscore-unhashed — hashing
+    a large DataFrame per lookup would cost more than the build — and
+    data_token (the statement + forecast settings that produced them)
+    carries their identity instead."""
+    df, forecast_df = _df, _forecast_df
+    if c_type == "bar": fig = px.bar(df, x=x_col, y=y_col, color=color_col, title=title, template=_TEMPLATE)
+    elif c_type == "line": fig = px.line(df, x=x_col, y=y_col, color=color_col, title=title, template=_TEMPLATE)
+    elif c_type == "pie": fig = px.pie(df, names=x_col, values=y_col, title=title, template=_TEMPLATE)
+    elif c_type == "scatter": fig = px.scatter(df, x=x_col, y=y_col, color=color_col, title=title, template=_TEMPLATE)
+    elif c_type == "area": fig = px.area(df, x=x_col, y=y_col, color=color_col, title=title, template=_TEMPLATE)
+    else: fig = px.bar(df, x=x_col, y=y_col, title=title, template=_TEMPLATE)
+
+    if forecast_df is not None:
+        fig.add_trace(go.Scatter(x=forecast_df[x_col], y=forecast_df[y_col], mode='lines', name=f'Forecast ({int(growth*100)}%)', line=dict(color='#00E5FF', width=3, dash='dot')))
+    return fig.to_plotly_json()
+
+@lru_cache(maxsize=512)
+def _probe_datetime(sample):
+    """Memoized date sniff on a 20-value sample: the old full-column
+    pd.to_datetime probe re-parsed (or re-raised on) every row of every
+    chart on every rerun just to set one boolean."""
+    try:
+        pd.to_datetime(pd.Series(sample))
+        return True
+    except Exception:
+        return False
+
+@lru_cache(maxsize=1024)
+def _format_cached(val, fmt):
+    """Dashboards repeat the same totals across reruns; the float/branch/
+    f-string work runs once per distinct (value, format) pair. Dispatch on
+    fmt first so each branch pays only its own conversion."""
+    try:
+        if fmt == "currency": return f"${float(val):,.2f}"
+        if fmt == "percent": return f"{float(val):.1f}%"
+        v = float(val)
+        if v.is_integer(): return f"{int(v):,}"
+        return f"{v:,.2f}"
+    except: return str(val)
+
+_KPI_CARD_TPL = """
+<div class="css-1r6slb0">
+    <h4 style='margin:0; color:#94a3b8; font-size:14px;'>{label}</h4>
+    <h2 style='margin:0; color:#fff; font-size:28px;'>{val}</h2>
+</div>
+"""
 from modules.forecaster import StallionForecaster
 # Import Copilot for the 'Deep Insights' feature
-from modules.copilot import StallionCopilot
+from modules.copilot import get_shared_copilot
 
 class StallionRenderer:
     """
@@ -12,16 +164,8 @@ class StallionRenderer:
     """
     
     def __init__(self, db_engine):
-        self.db = db_engine 
-        self.layout_style = dict(
-            paper_bgcolor='rgba(0,0,0,0)',
-            plot_bgcolor='rgba(0,0,0,0)',
-            font=dict(color='#fafafa'),
-            margin=dict(t=30, l=10, r=10, b=10),
-            xaxis=dict(showgrid=False),
-            yaxis=dict(showgrid=True, gridcolor='rgba(255,255,255,0.1)')
-        )
-        
+        self.db = db_engine
+
         if "active_filters" not in st.session_state:
             st.session_state["active_filters"] = {}
 
@@ -38,55 +182,117 @@ class StallionRenderer:
                     st.session_state["active_filters"] = {}
                     st.rerun()
         
+        # All dashboard SQL goes through one cached fetch stage (see
+        # _fetch_dashboard_data): rerun with unchanged filters = zero queries
+        kpis = config.get("kpi_cards")
+        charts = config.get("charts")
+        fused_stmt = self._fused_kpi_sql(kpis) if kpis else None
+        chart_stmts = tuple(self._inject_filters(c.get("sql_query")) for c in charts) if charts else ()
+
+        kpi_result, chart_results = (None, [])
+        if kpis or charts:
+            kpi_result, chart_results = _fetch_dashboard_data(id(self.db), fused_stmt, chart_stmts, self.db)
+
         # 1. KPIs
-        if "kpi_cards" in config:
-            self._render_sql_kpis(config["kpi_cards"])
+        if kpis:
+            self._render_sql_kpis(kpis, kpi_result)
         st.markdown("---")
         # 2. Charts
-        if "charts" in config:
-            self._render_sql_charts(config["charts"])
+        if charts:
+            self._render_sql_charts(charts, chart_results)
 
     def _inject_filters(self, sql):
-        if not st.session_state["active_filters"]: return sql
-        clauses = []
-        for col, val in st.session_state["active_filters"].items():
-            if isinstance(val, str): clauses.append(f"{col} = '{val}'")
-            else: clauses.append(f"{col} = {val}")
-        filter_sql = " AND ".join(clauses)
-        return f"SELECT * FROM ({sql}) WHERE {filter_sql}"
-
-    def _render_sql_kpis(self, kpis):
+        """Returns (sql, params). Filter values are bound as prepared-statement
+        parameters: DuckDB reuses the cached plan across value changes, and a
+        clicked label containing a quote can't break (or inject into) the SQL."""
+        filters = st.session_state["active_filters"]
+        params = tuple(filters.values())
+        # Agent-emitted queries carry a {filters} marker after WHERE 1=1 in the
+        # innermost scan: predicates land there, BEFORE aggregation, so DuckDB
+        # filters the base table instead of the grouped result
+        if "{filters}" in sql:
+            extra = "".join(f" AND {col} = ?" for col in filters)
+            return sql.replace("{filters}", extra), params
+        if not filters: return sql, ()
+        filter_sql = " AND ".join(f"{col} = ?" for col in filters)
+        # Plain SELECT-FROM queries get the predicate inline at the scan;
+        # anything with clauses/aggregates keeps the always-correct wrap
+        if not _COMPLEX_SQL.search(sql):
+            return f"{sql.rstrip().rstrip(';')} WHERE {filter_sql}", params
+        return f"SELECT * FROM ({sql}) WHERE {filter_sql}", params
+
+    def _fused_kpi_sql(self, kpis):
+        # Fuse all KPI scalars into ONE query: 1 DuckDB round-trip instead of N.
+        # Returns (sql, params) with each subquery's bindings in order.
+        parts, params = [], []
+        for i, kpi in enumerate(kpis):
+            sql, p = self._inject_filters(kpi.get('sql_query'))
+            parts.append(f"({sql}) AS k{i}")
+            params.extend(p)
+        return "SELECT " + ", ".join(parts), tuple(params)
+
+    def _render_sql_kpis(self, kpis, prefetched=None):
         cols = st.columns(len(kpis))
+        if prefetched is None:
+            sql, params = self._fused_kpi_sql(kpis)
+            tbl, error = self.db.run_query_arrow(sql, list(params) or None)
+            vals = tuple(col[0].as_py() for col in tbl.columns) if tbl is not None and tbl.num_rows else ()
+            prefetched = (vals if error is None else None, error)
+        vals, error = prefetched
         for idx, kpi in enumerate(kpis):
             with cols[idx]:
-                filtered_sql = self._inject_filters(kpi.get("sql_query"))
-                df, _ = self.db.run_query(filtered_sql)
+                if error:
+                    # Fallback: one bad KPI query shouldn't blank the whole row
+                    sql, params = self._inject_filters(kpi.get("sql_query"))
+                    df, _ = self.db.run_query(sql, list(params) or None)
+                    raw = df.iloc[0, 0] if not df.empty else None
+                else:
+                    raw = vals[idx] if vals and idx < len(vals) else None
                 val = "N/A"
-                if not df.empty: val = self._format_metric(df.iloc[0, 0], kpi.get("format"))
-                st.markdown(f"""
-                <div class="css-1r6slb0">
-                    <h4 style='margin:0; color:#94a3b8; font-size:14px;'>{kpi.get('label')}</h4>
-                    <h2 style='margin:0; color:#fff; font-size:28px;'>{val}</h2>
-                </div>
-                """, unsafe_allow_html=True)
-
-    def _render_sql_charts(self, charts):
-        for i in range(0, len(charts), 2):
-            c1, c2 = st.columns(2)
-            with c1: self._draw_chart(charts[i], key=f"chart_{i}")
-            if i + 1 < len(charts):
-                with c2: self._draw_chart(charts[i+1], key=f"chart_{i+1}")
-
-    def _draw_chart(self, chart_config, key):
+                if raw is not None: val = self._format_metric(raw, kpi.get("format"))
+                st.markdown(_KPI_CARD_TPL.format(label=kpi.get('label'), val=val), unsafe_allow_html=True)
+
+    def _fetch_chart(self, stmt):
+        """Thread-safe chart fetch: each call queries through its own cursor.
+        DuckDB releases the GIL during execution, so N charts cost ~1 round-trip.
+        stmt is a (sql, params) pair with filters already injected (they read
+        session_state on the main thread)."""
+        sql, params = stmt
+        try:
+            return self.db.conn.cursor().execute(sql, list(params) or None).df(), None
+        except Exception as e:
+            return pd.DataFrame(), str(e)
+
+    def _render_sql_charts(self, charts, results=None):
+        if results is None:
+            stmts = [self._inject_filters(c.get("sql_query")) for c in charts]
+            with ThreadPoolExecutor(max_workers=min(8, len(stmts))) as ex:
+                results = list(ex.map(self._fetch_chart, stmts))
+        # Flat loop into the grid: each chart fragment is an independent grid
+        # item, so there's no column pairing to block or rerun together
+        st.markdown(_GRID_CSS, unsafe_allow_html=True)
+        with st.container(key="chart_grid"):
+            for i, cfg in enumerate(charts):
+                self._draw_chart(cfg, key=f"chart_{i}", prefetched=results[i])
+
+    @st.fragment
+    def _draw_chart(self, chart_config, key, prefetched=None):
+        # Fragment scope: forecast sliders, the Analyze button and selection
+        # events rerun only this chart (reusing the captured prefetched frame),
+        # not the whole dashboard. Cross-filter clicks below still escalate
+        # with st.rerun(scope="app") because filters affect every widget.
         title = chart_config.get("title", "Untitled Chart")
         base_sql = chart_config.get("sql_query")
         c_type = chart_config.get("type", "bar")
         description = chart_config.get("description")
-        
-        # 1. Execution
-        filtered_sql = self._inject_filters(base_sql)
-        df, error = self.db.run_query(filtered_sql)
-        
+
+        # 1. Execution (pre-fetched in parallel when rendered as part of a grid)
+        if prefetched is not None:
+            df, error = prefetched
+        else:
+            filtered_sql, params = self._inject_filters(base_sql)
+            df, error = self.db.run_query(filtered_sql, list(params) or None)
+
         if error:
             st.error(f"Query Failed for '{title}': {error}")
             return
@@ -100,15 +306,18 @@ class StallionRenderer:
         color_col = chart_config.get("color_column", None)
 
         # 3. FORECAST WIDGET
+        # Only forecast-capable chart types pay for the probe; real datetime
+        # dtypes answer instantly and string columns are sniffed via a sample
         is_time_series = False
-        try:
-            pd.to_datetime(df[x_col])
-            is_time_series = True
-        except:
-            is_time_series = False
+        if c_type in ("line", "area", "bar"):
+            if is_datetime64_any_dtype(df[x_col]):
+                is_time_series = True
+            else:
+                is_time_series = _probe_datetime(tuple(df[x_col].head(20).astype(str)))
 
         forecast_df = None
         growth = 0.0
+        periods = 0
         
         if is_time_series and c_type in ["line", "area", "bar"]:
             with st.expander(f"🔮 Forecast Lab: {title}", expanded=False):
@@ -124,33 +333,33 @@ class StallionRenderer:
                         st.caption(f"**Model:** {info}")
 
         try:
-            # 4. Plotly Chart
-            if c_type == "bar": fig = px.bar(df, x=x_col, y=y_col, color=color_col, title=title, template="plotly_dark")
-            elif c_type == "line": fig = px.line(df, x=x_col, y=y_col, color=color_col, title=title, template="plotly_dark")
-            elif c_type == "pie": fig = px.pie(df, names=x_col, values=y_col, title=title, template="plotly_dark")
-            elif c_type == "scatter": fig = px.scatter(df, x=x_col, y=y_col, color=color_col, title=title, template="plotly_dark")
-            elif c_type == "area": fig = px.area(df, x=x_col, y=y_col, color=color_col, title=title, template="plotly_dark")
-            else: fig = px.bar(df, x=x_col, y=y_col, title=title, template="plotly_dark")
-
-            if forecast_df is not None:
-                fig.add_trace(go.Scatter(x=forecast_df[x_col], y=forecast_df[y_col], mode='lines', name=f'Forecast ({int(growth*100)}%)', line=dict(color='#00E5FF', width=3, dash='dot')))
-
-            fig.update_layout(self.layout_style)
+            # 4. Plotly Chart (cached dict: see _build_fig_dict). Long series
+            # are LTTB-downsampled for plotting only — the forecast above and
+            # the insights below keep the full frame
+            plot_df = df
+            if c_type in ("line", "area", "scatter") and len(df) > _MAX_PLOT_POINTS:
+                plot_df = _lttb(df, y_col)
+            # Identity of the frames without hashing them: the statement that
+            # produced the data plus the forecast knobs
+            data_token = (self._inject_filters(base_sql), id(self.db),
+                          periods if forecast_df is not None else None)
+            fig = _build_fig_dict(c_type, data_token, x_col, y_col, color_col, title, plot_df, forecast_df, growth)
             selection = st.plotly_chart(fig, use_container_width=True, on_select="rerun", key=key)
             
             # 5. DEEP INSIGHTS (Interactive Agent)
             with st.expander(f"🧠 Deep Insights: {title}"):
                 if st.button("⚡ Analyze this Chart", key=f"anl_{key}"):
-                    if st.session_state.get("api_key"):
-                        copilot = StallionCopilot(
-                            st.session_state.get("ai_provider"), 
-                            st.session_state.get("api_key"), 
+                    api_key = st.session_state.get("api_key")
+                    if api_key:
+                        copilot = get_shared_copilot(
+                            st.session_state.get("ai_provider"),
                             st.session_state.get("ai_model"),
-                            self.db
+                            hashlib.sha256(api_key.encode()).hexdigest(),
+                            id(self.db), api_key, self.db
                         )
                         with st.spinner("Agent is analyzing data patterns..."):
-                            insight = copilot.generate_chart_insight(df, title)
-                            st.markdown(insight)
+                            # Stream tokens as they arrive instead of waiting for the full answer
+                            st.write_stream(copilot.generate_chart_insight(df, title, stream=True))
                     else:
                         st.error("Please configure AI Settings in Sidebar.")
                 else:
@@ -162,18 +371,19 @@ class StallionRenderer:
                 point = selection["selection"]["points"][0]
                 if "x" in point:
                     st.session_state["active_filters"][x_col] = point["x"]
-                    st.rerun()
+                    st.rerun(scope="app")
 
         except Exception as e:
             st.warning(f"Plotting Error in '{title}': {str(e)}")
 
     def _format_metric(self, val, fmt):
+        # Typed fast paths: the common None and plain-int cases skip the
+        # cache lookup, float() round-trip and is_integer() entirely
+        if val is None:
+            return "0"
+        if isinstance(val, (int, np.integer)) and fmt not in ("currency", "percent"):
+            return f"{int(val):,}"
         try:
-            if val is None: return "0"
-            val = float(val)
-            if fmt == "currency": return f"${val:,.2f}"
-            elif fmt == "percent": return f"{val:.1f}%"
-            else: 
-                if val.is_integer(): return f"{int(val):,}"
-                return f"{val:,.2f}"
-        except: return str(val)
\ No newline at end of file
+            return _format_cached(val, fmt)
+        except TypeError:  # unhashable value: format without the cache
+            return str(val)
\ No newline at end of file
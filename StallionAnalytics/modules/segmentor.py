@@ -1,7 +1,5 @@
 import pandas as pd
 import numpy as np
-from sklearn.cluster import KMeans
-from sklearn.preprocessing import StandardScaler
 import warnings
 import json
 
@@ -82,6 +80,9 @@ class StallionSegmentor:
             (pd.DataFrame, str): The labeled dataframe and a markdown summary of cluster stats.
         """
         try:
+            # Lazy: sklearn only loads when a segmentation actually runs
+            from sklearn.cluster import MiniBatchKMeans
+
             if df.empty: return None, "No data to segment."
             
             features = pd.DataFrame()
@@ -96,25 +97,26 @@ class StallionSegmentor:
                 if not (id_col and date_col and amt_col):
                     return None, "RFM Strategy missing required columns in config."
                 
-                # Pre-processing
-                data = df.copy()
+                # Pre-processing: copy only the three columns RFM reads (not
+                # the full transaction frame), coerce in place, and drop bad
+                # rows with one combined mask instead of a per-column dropna
+                data = df[[id_col, date_col, amt_col]].copy()
                 data[date_col] = pd.to_datetime(data[date_col], errors='coerce')
                 data[amt_col] = pd.to_numeric(data[amt_col], errors='coerce')
-                data = data.dropna(subset=[id_col, date_col, amt_col])
+                data = data.loc[data.notna().all(axis=1)]
                 
                 # Snapshot date (1 day after max date)
                 snapshot = data[date_col].max() + pd.Timedelta(days=1)
                 
-                # Aggregation
-                features = data.groupby(id_col).agg({
-                    date_col: lambda x: (snapshot - x.max()).days, # Recency
-                    id_col: 'count',                                # Frequency
-                    amt_col: 'sum'                                  # Monetary
-                }).rename(columns={
-                    date_col: 'Recency',
-                    id_col: 'Frequency',
-                    amt_col: 'Monetary'
-                })
+                # Aggregation — all three metrics ride pandas' C fast paths:
+                # the old per-group recency lambda dropped the whole groupby
+                # into Python-loop apply mode
+                g = data.groupby(id_col, sort=False)
+                features = pd.concat([
+                    (snapshot - g[date_col].max()).dt.days.rename('Recency'),
+                    g.size().rename('Frequency'),
+                    g[amt_col].sum().rename('Monetary'),
+                ], axis=1)
                 
                 # Clean outliers (negative recency/money)
                 features = features[(features['Monetary'] > 0) & (features['Recency'] >= 0)]
@@ -132,10 +134,12 @@ class StallionSegmentor:
                 
                 # Aggregation (if ID exists and duplicates present)
                 if id_col and id_col in df.columns:
-                     # Check if we need to group by ID
-                    if df.duplicated(subset=[id_col]).any():
+                     # Check if we need to group by ID: nunique vs len answers
+                     # the same question as duplicated().any() without
+                     # materializing a boolean mask over the whole column
+                    if df[id_col].nunique(dropna=False) != len(df):
                         # Defaulting to mean for behavioral metrics
-                        features = df.groupby(id_col)[valid_cols].mean()
+                        features = df.groupby(id_col, sort=False)[valid_cols].mean()
                     else:
                         features = df.set_index(id_col)[valid_cols]
                 else:
@@ -149,24 +153,33 @@ class StallionSegmentor:
                 return None, f"Not enough data points ({len(features)}) for {n_clusters} clusters."
 
             # 1. Log Transform (Handle skewed distributions common in business data)
-            # Using log1p to handle zeros safely
-            features_log = np.log1p(features.select_dtypes(include=np.number))
-            
-            # 2. Scaling
-            scaler = StandardScaler()
-            features_scaled = scaler.fit_transform(features_log)
-            
-            # 3. K-Means
-            kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init=10)
-            clusters = kmeans.fit_predict(features_scaled)
+            # Using log1p to handle zeros safely; float32 end-to-end halves the
+            # working set vs the old float64 pipeline. Everything mutates the
+            # one array in place (np.log1p(out=...), -=, /=) so the whole prep
+            # allocates a single matrix instead of a temporary per step.
+            arr = features.select_dtypes(include=np.number).to_numpy(dtype=np.float32, copy=True)
+            np.log1p(arr, out=arr)
+
+            # 2. Scaling: two reductions instead of a StandardScaler fit pass
+            mu = arr.mean(axis=0)
+            sd = arr.std(axis=0)
+            sd[sd == 0] = 1
+            arr -= mu
+            arr /= sd
+
+            # 3. K-Means: mini-batch Lloyd's with 3 restarts — the old full
+            # KMeans(n_init=10) ran the complete algorithm ten times
+            kmeans = MiniBatchKMeans(n_clusters=n_clusters, random_state=42, n_init=3, batch_size=4096)
+            clusters = kmeans.fit_predict(arr)
             
             # 4. Attach Clusters to Original Data
             features['Cluster'] = clusters
             
             # 5. Generate Summary Stats for AI Context
-            # Group by Cluster and get mean of features
-            summary_stats = features.groupby('Cluster').mean().round(2)
-            summary_stats['Count'] = features['Cluster'].value_counts()
+            # Single groupby shared between mean and count (one grouping pass, not two)
+            grouped = features.groupby('Cluster')
+            summary_stats = grouped.mean().round(2)
+            summary_stats['Count'] = grouped.size()
             
             # Sort by count or primary metric for better readability
             summary_stats = summary_stats.sort_values(by='Count', ascending=False)
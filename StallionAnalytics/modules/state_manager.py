@@ -1,5 +1,5 @@
+import json
 import streamlit as st
-from modules.db_manager import StallionDB
 
 def init_session_state():
     defaults = {
@@ -8,6 +8,7 @@ def init_session_state():
         "processed_data": None,
         "data_metadata": "",
         "dashboard_config": {},
+        "_dashboard_config_json": "{}",  # Serialized twin, kept in sync by set_dashboard_config
         "chat_history": [],
         "notifications": [],
         "api_key": None,
@@ -26,3 +27,11 @@ def init_session_state():
 
 def set_page(page_name):
     st.session_state["page"] = page_name
+
+def set_dashboard_config(config):
+    """
+    Single write-path for the dashboard config. Serializes once on write so
+    the Co-Pilot prompt builder doesn't re-walk the whole dict every chat turn.
+    """
+    st.session_state["dashboard_config"] = config
+    st.session_state["_dashboard_config_json"] = json.dumps(config, separators=(',', ':'))
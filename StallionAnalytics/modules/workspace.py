@@ -1,92 +1,151 @@
 import json
 import os
+import threading
 import datetime
-from modules.copilot import StallionCopilot
+from concurrent.futures import ThreadPoolExecutor
 
-WORKSPACE_FILE = "stallion_workspace.json"
+# Context-signature summaries run off the save path: persisting a dashboard
+# must not block on an LLM round-trip
+_SIG_EXECUTOR = ThreadPoolExecutor(max_workers=2)
+
+WORKSPACE_FILE = "stallion_workspace.jsonl"
+LEGACY_WORKSPACE_FILE = "stallion_workspace.json"
 
 class StallionWorkspace:
     """
     The Persistence Engine for Stallion Analytics.
     Manages 'Context-Injected' Saves.
+
+    Storage is append-only JSONL with an in-memory live view: saves and
+    deletes append one line (deletes as tombstones) instead of re-parsing
+    and rewriting the whole file, and reads come straight from the dict.
+    The file is compacted down to live records when tombstones/overwrites
+    make it grow past twice the live set.
     """
-    
+
     def __init__(self):
-        self._ensure_file_exists()
+        self._lock = threading.Lock()
+        self._data = {}        # id -> record, tombstones already applied
+        self._total_lines = 0
+        self._load()
+
+    def _load(self):
+        # One-time migration from the old read-modify-write JSON format
+        if not os.path.exists(WORKSPACE_FILE) and os.path.exists(LEGACY_WORKSPACE_FILE):
+            try:
+                with open(LEGACY_WORKSPACE_FILE, 'r') as f:
+                    legacy = json.load(f)
+                with open(WORKSPACE_FILE, 'w') as f:
+                    for record in legacy.values():
+                        f.write(json.dumps(record) + "\n")
+            except Exception:
+                pass
 
-    def _ensure_file_exists(self):
         if not os.path.exists(WORKSPACE_FILE):
+            open(WORKSPACE_FILE, 'w').close()
+            return
+
+        with open(WORKSPACE_FILE, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                self._total_lines += 1
+                try:
+                    record = json.loads(line)
+                except Exception:
+                    continue  # Torn write: skip the bad line, keep the rest
+                if record.get("_deleted"):
+                    self._data.pop(record.get("id"), None)
+                else:
+                    self._data[record.get("id")] = record
+
+    def _append(self, record):
+        with open(WORKSPACE_FILE, 'a') as f:
+            f.write(json.dumps(record) + "\n")
+        self._total_lines += 1
+
+    def _maybe_compact(self):
+        # Rewrite only when dead lines dominate; keeps append cost O(1)
+        if self._total_lines > 16 and self._total_lines > 2 * max(1, len(self._data)):
             with open(WORKSPACE_FILE, 'w') as f:
-                json.dump({}, f)
+                for record in self._data.values():
+                    f.write(json.dumps(record) + "\n")
+            self._total_lines = len(self._data)
 
     def save_work(self, name, description, dashboard_config, ai_engine=None):
         """
         Saves the dashboard with an AI-generated Context Signature.
+        The save itself is a single appended line; the signature summary is
+        filled in by a background worker so the button never waits on the LLM.
         """
-        # 1. Generate Context Signature (if AI is available)
-        context_signature = {
-            "intent": description, # User defined
-            "automated_summary": "No AI summary available."
-        }
-        
-        if ai_engine and dashboard_config:
-            try:
-                # Extract chart titles for context
-                titles = [c.get('title') for c in dashboard_config.get('charts', [])]
-                kpis = [k.get('label') for k in dashboard_config.get('kpi_cards', [])]
-                
-                prompt = f"""
-                Generate a 'Context Signature' for this dashboard configuration.
-                Charts: {titles}
-                KPIs: {kpis}
-                User Description: "{description}"
-                
-                Task: Summarize the ANALYTICAL INTENT in 1 sentence. (e.g. "Investigating Q3 regional sales dip.")
-                """
-                context_signature["automated_summary"] = ai_engine._call_ai(prompt).strip()
-            except:
-                pass
-
-        # 2. Construct Record
+        # 1. Construct Record (summary lands asynchronously below)
         record = {
             "id": name.lower().replace(" ", "_"),
             "name": name,
             "created_at": datetime.datetime.now().strftime("%Y-%m-%d %H:%M"),
             "description": description,
-            "context_signature": context_signature,
+            "context_signature": {
+                "intent": description, # User defined
+                "automated_summary": "No AI summary available."
+            },
             "config": dashboard_config
         }
-        
-        # 3. Write to Disk
-        with open(WORKSPACE_FILE, 'r') as f:
-            data = json.load(f)
-        
-        data[record["id"]] = record
-        
-        with open(WORKSPACE_FILE, 'w') as f:
-            json.dump(data, f, indent=4)
-            
+
+        # 2. Append to Disk (one line, no full-file rewrite)
+        with self._lock:
+            self._data[record["id"]] = record
+            self._append(record)
+            self._maybe_compact()
+
+        # 3. Enrich off-thread (if AI is available)
+        if ai_engine and dashboard_config:
+            # Extract chart titles for context
+            titles = [c.get('title') for c in dashboard_config.get('charts', [])]
+            kpis = [k.get('label') for k in dashboard_config.get('kpi_cards', [])]
+
+            prompt = f"""
+            Generate a 'Context Signature' for this dashboard configuration.
+            Charts: {titles}
+            KPIs: {kpis}
+            User Description: "{description}"
+
+            Task: Summarize the ANALYTICAL INTENT in 1 sentence. (e.g. "Investigating Q3 regional sales dip.")
+            """
+            _SIG_EXECUTOR.submit(self._enrich_signature, record["id"], prompt, ai_engine)
+
         return True
 
+    def _enrich_signature(self, work_id, prompt, ai_engine):
+        """Background pass: fills in the AI summary and appends the updated
+        record (last line wins on replay). A failed call leaves the default."""
+        try:
+            summary = ai_engine._call_ai(prompt).strip()
+        except Exception:
+            return
+        with self._lock:
+            record = self._data.get(work_id)
+            if not record:
+                return  # Deleted while the summary was generating
+            record["context_signature"]["automated_summary"] = summary
+            self._append(record)
+            self._maybe_compact()
+
     def list_work(self):
         """Returns a list of saved dashboards."""
-        with open(WORKSPACE_FILE, 'r') as f:
-            data = json.load(f)
-        return list(data.values())
+        with self._lock:
+            return list(self._data.values())
 
     def load_work(self, work_id):
         """Returns the specific dashboard record."""
-        with open(WORKSPACE_FILE, 'r') as f:
-            data = json.load(f)
-        return data.get(work_id)
+        with self._lock:
+            return self._data.get(work_id)
 
     def delete_work(self, work_id):
-        with open(WORKSPACE_FILE, 'r') as f:
-            data = json.load(f)
-        
-        if work_id in data:
-            del data[work_id]
-            with open(WORKSPACE_FILE, 'w') as f:
-                json.dump(data, f)
-            return True
-        return False
\ No newline at end of file
+        with self._lock:
+            if work_id in self._data:
+                del self._data[work_id]
+                self._append({"id": work_id, "_deleted": True})
+                self._maybe_compact()
+                return True
+        return False